@@ -1,12 +1,42 @@
+import re
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
 from pydantic import BaseModel, ConfigDict
 import pytz
 
+from api.cost import record_series
+from api.correlation_cache import (
+    correlation_cache,
+    lag_offset_key,
+    pair_cache_key,
+    series_fingerprint,
+)
+from api.correlation_grid import CorrelationGrid, max_fixed_offset, min_variance
+from api.correlation_kernels import jit_available, lagged_pearson
+from api.correlation_sampling import (
+    approximate_key,
+    confidence_interval,
+    crosses_threshold,
+    min_sample_matches,
+    sample_positions,
+    sample_sizes,
+)
 from api.get_trend_data import fetch_pandas_data
-from api.models import CorrelationRequest, LagUnit
+from api.models import (
+    ChildrenGrouping,
+    CorrelationMethod,
+    CorrelationRequest,
+    LagUnit,
+)
+from api.single_flight import trend_data_flights
+from api.series_store import (
+    SeriesStore,
+    dataframe_nbytes,
+    is_mapped,
+    memory_budget_bytes,
+)
 
 
 class DataFrameInfo(BaseModel):
@@ -18,9 +48,60 @@ class DataFrameInfo(BaseModel):
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    @property
+    def name(self) -> str:
+        return self.dataframe.columns[0]
 
-def get_data(request: CorrelationRequest):
-    data_frames = []
+
+# Matched points kept for the plots when a pair of memory-mapped series is aligned
+aligned_max_points = 100_000
+
+
+class AlignedPair(BaseModel):
+    """
+    The matched samples of a pair at one lag, as compute_correlation aligned them:
+    'values1' and 'values2' are the values of columns[0] and columns[1] at the matched
+    'timestamps' (int64 nanoseconds, UTC, of the higher-frequency series) in time order.
+    'correlation' is the pair's correlation at this lag (None if not valid).
+    """
+
+    columns: tuple
+    lag_unit: Optional[LagUnit]
+    lag_step: int
+    correlation: Optional[float]
+    timestamps: np.ndarray
+    values1: np.ndarray
+    values2: np.ndarray
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def swapped(self, lag_step: int, correlation: Optional[float]) -> "AlignedPair":
+        """
+        The same matches with the columns reversed, labelled with the reversed pair's
+        lag step and correlation.
+        """
+        return self.model_copy(
+            update={
+                "columns": self.columns[::-1],
+                "lag_step": lag_step,
+                "correlation": correlation,
+                "values1": self.values2,
+                "values2": self.values1,
+            }
+        )
+
+
+def get_data(request: CorrelationRequest, resample_seconds: Optional[int] = None):
+    """
+    Fetches the requested series as DataFrameInfo objects, optionally resampled to the
+    mean over resample_seconds bins (see api.cost). Once the fetched series exceed
+    the memory budget (CORRELATION_MEMORY_BUDGET_MB), all of them are spilled to
+    memory-mapped files and MappedSeriesInfo objects are returned instead; release them
+    with release_series() when the request is done.
+    """
+    data_frame_infos = []
+    in_memory_bytes = 0
+    store = None
     timezone = pytz.timezone("Europe/Berlin")  # Desired timezone
 
     # Convert start_time and end_time to the desired timezone
@@ -31,173 +112,743 @@ def get_data(request: CorrelationRequest):
         else datetime.now(timezone)
     )
 
+    # Assets listed once per attribute are fetched only once, and their series are
+    # released before the next asset is fetched
+    assets_by_id = {}
     for asset in request.assets:
-        df = fetch_pandas_data(asset.asset_id, start_time, end_time)
+        assets_by_id.setdefault(asset.asset_id, []).append(asset)
 
-        # Convert the timestamp to the desired timezone (e.g., Europe/Berlin)
-        df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True).dt.tz_convert(
-            "Europe/Berlin"
+    for asset_id, assets in assets_by_id.items():
+        # Only the listed attributes are kept, unless one entry asks for all of them
+        attributes = None
+        if all(asset.attribute_name for asset in assets):
+            attributes = frozenset(asset.attribute_name for asset in assets)
+        # Concurrent requests for the same data share one fetch; the result is
+        # shared, so it is only read here
+        series_by_attribute = trend_data_flights.do(
+            (
+                asset_id,
+                start_time,
+                end_time if request.end_time else None,
+                attributes,
+            ),
+            fetch_pandas_data,
+            asset_id,
+            start_time,
+            end_time,
+            attributes,
         )
+        for asset in assets:
+            if asset.attribute_name:
+                if asset.attribute_name in series_by_attribute:
+                    attribute_names = [asset.attribute_name]
+                else:
+                    print(
+                        f"Attribute '{asset.attribute_name}' not found in asset {asset.asset_id}. Skipping this attribute."
+                    )
+                    continue
+            else:
+                attribute_names = list(series_by_attribute)
 
-        if asset.attribute_name:
-            if asset.attribute_name in df.columns:
-                df = df[["timestamp", asset.attribute_name]]
-                df.set_index("timestamp", inplace=True)
-                df.columns = [f"{asset.asset_id}_{asset.attribute_name}"]
+            for attribute_name in attribute_names:
+                df = series_by_attribute[attribute_name].to_frame(
+                    f"{asset.asset_id}_{attribute_name}"
+                )
                 df.dropna(inplace=True)  # Remove NaN values
-                data_frames.append(df)
-            else:
-                print(
-                    f"Attribute '{asset.attribute_name}' not found in asset {asset.asset_id}. Skipping this attribute."
+                record_series(
+                    asset.asset_id, attribute_name, len(df), start_time, end_time
                 )
-                continue
+                if resample_seconds:
+                    df = df.resample(f"{resample_seconds}s").mean().dropna()
+                df_info = dataframe_info(df)
+
+                in_memory_bytes += dataframe_nbytes(df)
+                if store is None and in_memory_bytes > memory_budget_bytes:
+                    # Switch to out-of-core mode, spilling everything fetched so far
+                    print(
+                        f"Fetched series exceed the memory budget of {memory_budget_bytes} bytes, switching to out-of-core mode"
+                    )
+                    store = SeriesStore()
+                    data_frame_infos = [store.spill(info) for info in data_frame_infos]
+                if store is not None:
+                    df_info = store.spill(df_info)
+                data_frame_infos.append(df_info)
+        del series_by_attribute
+
+    return data_frame_infos
+
+
+def dataframe_info(df: pd.DataFrame) -> DataFrameInfo:
+    frequency = pd.infer_freq(df.index)
+    if frequency is None:
+        diffs = df.index.to_series().diff().dropna()
+        if not diffs.empty:
+            most_common_diff = diffs.mode()[0]
+            frequency = pd.tseries.frequencies.to_offset(most_common_diff).freqstr
         else:
-            for column in df.columns:
-                if column != "timestamp":
-                    temp_df = df[["timestamp", column]].copy()
-                    temp_df.set_index("timestamp", inplace=True)
-                    temp_df.columns = [f"{asset.asset_id}_{column}"]
-                    temp_df.dropna(inplace=True)  # Remove NaN values
-                    data_frames.append(temp_df)
+            frequency = None
 
-    data_frame_infos = []
+    # Create DataFrameInfo instance
+    return DataFrameInfo(
+        dataframe=df,
+        frequency=frequency,
+        data_size=len(df),
+        start_date=df.index.min() if not df.empty else None,
+        end_date=df.index.max() if not df.empty else None,
+    )
 
-    for df in data_frames:
-        frequency = pd.infer_freq(df.index)
-        if frequency is None:
-            diffs = df.index.to_series().diff().dropna()
-            if not diffs.empty:
-                most_common_diff = diffs.mode()[0]
-                frequency = pd.tseries.frequencies.to_offset(most_common_diff).freqstr
-            else:
-                frequency = None
-
-        # Create DataFrameInfo instance
-        df_info = DataFrameInfo(
-            dataframe=df,
-            frequency=frequency,
-            data_size=len(df),
-            start_date=df.index.min() if not df.empty else None,
-            end_date=df.index.max() if not df.empty else None,
+
+def make_offset(lag_unit: LagUnit, step: int):
+    """
+    Build the offset for a given unit and a signed step. Fixed units are absolute
+    pd.Timedelta shifts, months and years are calendar pd.DateOffset shifts.
+    """
+    if lag_unit == LagUnit.seconds:
+        return pd.Timedelta(seconds=step)
+    elif lag_unit == LagUnit.minutes:
+        return pd.Timedelta(minutes=step)
+    elif lag_unit == LagUnit.hours:
+        return pd.Timedelta(hours=step)
+    elif lag_unit == LagUnit.days:
+        return pd.Timedelta(days=step)
+    elif lag_unit == LagUnit.months:
+        return pd.DateOffset(months=step)
+    elif lag_unit == LagUnit.years:
+        return pd.DateOffset(years=step)
+    else:
+        return pd.Timedelta(0)
+
+
+def shift_calendar(index: pd.DatetimeIndex, months: int) -> pd.DatetimeIndex:
+    """
+    Shifts timestamps by a number of calendar months with vectorized year/month/day
+    arithmetic on the local wall time. Days beyond the end of the target month are
+    clamped to its last day (Jan 31 + 1 month -> Feb 28/29), like pd.DateOffset(months=...).
+    Ambiguous local times resolve to the first (DST) occurrence, non-existent ones
+    are shifted forward.
+    """
+    if months == 0 or len(index) == 0:
+        return index
+
+    wall = index.tz_localize(None) if index.tz is not None else index
+    values = wall.values
+    days = values.astype("datetime64[D]")
+    time_of_day = values - days
+    month_start = values.astype("datetime64[M]")
+    day_of_month = days - month_start.astype("datetime64[D]")
+
+    target_month = month_start + np.timedelta64(months, "M")
+    target_first_day = target_month.astype("datetime64[D]")
+    days_in_target = (target_month + np.timedelta64(1, "M")).astype(
+        "datetime64[D]"
+    ) - target_first_day
+    clamped_day = np.minimum(day_of_month, days_in_target - np.timedelta64(1, "D"))
+
+    shifted = pd.DatetimeIndex(
+        (target_first_day + clamped_day).astype(values.dtype) + time_of_day
+    )
+    if index.tz is not None:
+        shifted = shifted.tz_localize(
+            index.tz,
+            ambiguous=np.ones(len(shifted), dtype=bool),
+            nonexistent="shift_forward",
         )
-        data_frame_infos.append(df_info)
+    return shifted
 
-    return data_frame_infos
+
+def shift_index(
+    index: pd.DatetimeIndex, lag_unit: LagUnit, step: int
+) -> pd.DatetimeIndex:
+    """Shifts a DatetimeIndex by a signed step of the given unit."""
+    if lag_unit == LagUnit.months:
+        return shift_calendar(index, step)
+    if lag_unit == LagUnit.years:
+        return shift_calendar(index, 12 * step)
+    return index + make_offset(lag_unit, step)
 
 
-def compute_correlation(data_frame_infos, request: CorrelationRequest):
+def frequency_to_timedelta(freq: Optional[str]) -> Optional[pd.Timedelta]:
+    """
+    Converts a fixed pandas frequency string (e.g., '15min', 'h', 'D', or the older
+    aliases '15T', 'H', 'S') to a pd.Timedelta. Returns None if frequency is None or
+    not a fixed frequency (e.g. 'MS').
+    """
+    if freq is None:
+        return None
+    # Aliases removed in pandas 3, as inferred by older pandas versions
+    match = re.fullmatch(r"(\d*)(T|H|S)", freq)
+    if match:
+        freq = match.group(1) + {"T": "min", "H": "h", "S": "s"}[match.group(2)]
+    try:
+        offset = pd.tseries.frequencies.to_offset(freq)
+    except ValueError:
+        return None
+    if isinstance(offset, pd.offsets.Day):
+        return pd.Timedelta(days=offset.n)
+    if isinstance(offset, pd.offsets.Tick):
+        return pd.Timedelta(offset)
+    return None
+
+
+def order_by_frequency(df_info1, df_info2):
+    """
+    Returns (left_info, right_info, tolerance) where 'left_info' is the higher-frequency
+    series and 'tolerance' is its sampling interval (None if unknown).
+    """
+    freq1 = frequency_to_timedelta(df_info1.frequency)
+    freq2 = frequency_to_timedelta(df_info2.frequency)
+
+    if freq1 is not None and freq2 is not None:
+        if freq1 < freq2:
+            return df_info1, df_info2, freq1
+        return df_info2, df_info1, freq2
+
+    # Fallback if we can't parse frequencies
+    return df_info1, df_info2, None
+
+
+def swaps_roles(df_info1, df_info2) -> bool:
+    """
+    Whether reversing the pair swaps its left and right series in order_by_frequency
+    (equal or unknown frequencies). Otherwise both orders shift the same series by the
+    lags and give the same result.
+    """
+    left_info = order_by_frequency(df_info1, df_info2)[0]
+    return order_by_frequency(df_info2, df_info1)[0].name != left_info.name
+
+
+def compute_correlation(
+    data_frame_infos,
+    request: CorrelationRequest,
+    lag_stride: int = 1,
+    prune_symmetric_pairs: bool = False,
+    pairs=None,
+    return_aligned: bool = False,
+):
     """
     Goes through all pairs of DataFrameInfo objects. If request.lags is provided,
     it will sweep from -lag_value to +lag_value for each {lag_unit: lag_value} in the list,
     matching the higher-frequency DataFrame to the nearest timestamps in the lower-frequency DataFrame
     within a tolerance of the higher frequency.
 
+    request.method selects Pearson, Spearman or Kendall correlation. Spearman ranks are
+    derived from a sort order computed once per series, Kendall uses scipy's O(n log n) tau-b.
+
     We only store lag_details if the correlation is a valid (non-null) value.
     Additionally, correlation values are rounded to 4 decimal places.
+
+    Results are cached per pair (see api.correlation_cache), so pairs shared with
+    earlier requests over the same data and lag spec are not recomputed.
+
+    Pearson correlations of in-memory series sharing one regular frequency are computed
+    for all pairs at once, one matrix multiply per lag (see api.correlation_grid).
+    Otherwise, with numba installed, they are computed by the compiled kernel in
+    api.correlation_kernels, all steps of a lag unit in one call.
+
+    Memory-mapped series (see api.series_store) are correlated block by block with
+    blocked_pearson; only the Pearson method is supported for them.
+
+    Cheaper modes for requests over the cost budget (see api.cost): lag_stride > 1
+    searches the lags coarsely and refines around the best coarse step, and
+    prune_symmetric_pairs computes each pair once and reuses it for the reversed pair:
+    mirrored (with negated lags) if the left/right roles swap, as for equal or unknown
+    frequencies, otherwise unchanged (see swaps_roles).
+
+    'pairs' optionally restricts the computation to a set of (name1, name2) pairs, see
+    select_pairs().
+
+    With request.approximate, every correlation is estimated from a random sample of
+    the higher-frequency series matched to the other one, and reported with its
+    confidence interval at request.confidence_level and the sample size. Samples grow
+    (see api.correlation_sampling) only while the interval crosses
+    ±request.approximate_threshold; at the full series size the value is exact.
+
+    With return_aligned=True, (correlations, aligned) is returned, where 'aligned' maps
+    every "col1 and col2" key of two different series to {"zero_lag": AlignedPair,
+    "best_lag": AlignedPair}, the matched samples the plots are drawn from. Each pair is
+    aligned once, the reversed pair reuses its matches. Memory-mapped pairs keep an
+    evenly strided sample of at most aligned_max_points matches.
     """
     correlation_details = {}
+    # Pairs whose results are the mirrored (roles swapped) or copied (same roles)
+    # results of the reversed pair
+    mirrored = set()
+    copied = set()
+    method = request.method
+    mapped = {info.name: info for info in data_frame_infos if is_mapped(info)}
+    if mapped and method != CorrelationMethod.pearson:
+        raise ValueError(
+            "Only the pearson method is supported for data exceeding the memory budget."
+        )
+    fingerprints = [series_fingerprint(df_info) for df_info in data_frame_infos]
+    arrays = {
+        df_info.name: series_arrays(df_info.dataframe)
+        for df_info in data_frame_infos
+        if not is_mapped(df_info)
+    }
+    timezones = {
+        df_info.name: df_info.dataframe.index.tz
+        for df_info in data_frame_infos
+        if not is_mapped(df_info)
+    }
+    # Means of the memory-mapped series, the reference point of the blocked sums
+    means = {}
+    # Sort orders for the Spearman ranks, computed once per series
+    rank_orders = {}
+    # Calendar shifts (months/years) are computed once per series and step for all pairs
+    calendar_shift_cache = {}
+    # The common grid of all series, built on first use (None if they don't share one)
+    grids = {}
+    # Matched samples per pair for the plots, filled with return_aligned=True
+    aligned = {}
+    # Random samples (timestamps, values) of the series by name and size, and the
+    # (confidence interval, sample size) of every approximate correlation
+    samples = {}
+    sample_stats = {}
 
-    def make_offset(lag_unit: LagUnit, step: int):
-        """Build a pd.DateOffset for a given unit (hours, months, etc.) and a signed step."""
-        if lag_unit == LagUnit.seconds:
-            return pd.DateOffset(seconds=step)
-        elif lag_unit == LagUnit.minutes:
-            return pd.DateOffset(minutes=step)
-        elif lag_unit == LagUnit.hours:
-            return pd.DateOffset(hours=step)
-        elif lag_unit == LagUnit.days:
-            return pd.DateOffset(days=step)
-        elif lag_unit == LagUnit.months:
-            return pd.DateOffset(months=step)
-        elif lag_unit == LagUnit.years:
-            return pd.DateOffset(years=step)
-        else:
-            return pd.DateOffset(0)
+    def common_grid():
+        if "grid" not in grids:
+            grids["grid"] = None
+            # Sparse pair selections are cheaper pair by pair than as full N x N slices
+            dense = pairs is None or 4 * len(pairs) >= len(data_frame_infos) ** 2
+            exact = method == CorrelationMethod.pearson and not request.approximate
+            if exact and not mapped and dense:
+                grids["grid"] = CorrelationGrid.build(
+                    arrays,
+                    [
+                        frequency_to_timedelta(info.frequency)
+                        for info in data_frame_infos
+                    ],
+                    max_fixed_offset(request.lags),
+                )
+        return grids["grid"]
+
+    def shifted_timestamps(col, lag_unit, step):
+        timestamps = arrays[col][0]
+        if lag_unit is None or step == 0:
+            return timestamps
+        if lag_unit in (LagUnit.months, LagUnit.years):
+            shift_key = (col,) + lag_offset_key(lag_unit, step)
+            if shift_key not in calendar_shift_cache:
+                index = pd.DatetimeIndex(timestamps, tz="UTC").tz_convert(
+                    timezones[col]
+                )
+                calendar_shift_cache[shift_key] = (
+                    shift_index(index, lag_unit, step).as_unit("ns").asi8
+                )
+            return calendar_shift_cache[shift_key]
+        return timestamps + make_offset(lag_unit, step).value
+
+    def rank_order(col):
+        if col not in rank_orders:
+            rank_orders[col] = np.argsort(arrays[col][1], kind="stable")
+        return rank_orders[col]
 
-    def frequency_to_timedelta(freq: Optional[str]) -> Optional[pd.Timedelta]:
+    def mapped_shift(right_col, lag_unit, step):
         """
-        Converts a pandas frequency string (e.g., 'S', 'T', 'H', 'D') to a pd.Timedelta.
-        Returns None if frequency is None or not in the map.
+        (right timestamps, right values, offset in nanoseconds) of a memory-mapped right
+        series; calendar shifts are stored sorted, with the values in the same order.
         """
-        if freq is None:
-            return None
-        freq_map = {
-            "S": pd.Timedelta(seconds=1),
-            "T": pd.Timedelta(minutes=1),
-            "min": pd.Timedelta(minutes=1),
-            "H": pd.Timedelta(hours=1),
-            "D": pd.Timedelta(days=1),
+        right = mapped[right_col]
+        if lag_unit is None or step == 0:
+            return right.timestamps, right.values, 0
+        if lag_unit in (LagUnit.months, LagUnit.years):
+            shift_key = (right_col,) + lag_offset_key(lag_unit, step)
+            if shift_key not in calendar_shift_cache:
+                calendar_shift_cache[shift_key] = right.shifted(
+                    lambda index: shift_index(index, lag_unit, step)
+                )
+            return calendar_shift_cache[shift_key] + (0,)
+        return right.timestamps, right.values, make_offset(lag_unit, step).value
+
+    def mapped_correlation(left_col, right_col, tolerance, lag_unit=None, step=0):
+        left, right = mapped[left_col], mapped[right_col]
+        for info in (left, right):
+            if info.name not in means:
+                means[info.name] = info.mean()
+        right_timestamps, right_values, offset = mapped_shift(right_col, lag_unit, step)
+        return blocked_pearson(
+            left,
+            right_timestamps,
+            right_values,
+            offset,
+            tolerance,
+            means[left.name],
+            means[right.name],
+        )
+
+    def use_kernel(left_col, right_col):
+        return (
+            jit_available
+            and method == CorrelationMethod.pearson
+            and left_col not in mapped
+            and right_col not in mapped
+            and common_grid() is None
+        )
+
+    def kernel_correlations(left_col, right_col, tolerance, right_timestamps, offsets):
+        if np.any(right_timestamps[1:] < right_timestamps[:-1]):
+            return None  # the kernel needs sorted timestamps
+        left_timestamps, left_values = arrays[left_col]
+        return lagged_pearson(
+            left_timestamps,
+            left_values,
+            right_timestamps,
+            arrays[right_col][1],
+            offsets,
+            tolerance,
+        )
+
+    def lagged_correlation(left_col, right_col, tolerance, lag_unit=None, step=0):
+        if left_col in mapped:
+            return mapped_correlation(left_col, right_col, tolerance, lag_unit, step)
+        if common_grid() is not None and lag_unit not in (
+            LagUnit.months,
+            LagUnit.years,
+        ):
+            offset = 0 if lag_unit is None else make_offset(lag_unit, step).value
+            correlation = common_grid().correlation(left_col, right_col, offset)
+            if correlation is not None:
+                return correlation
+        if use_kernel(left_col, right_col):
+            correlations = kernel_correlations(
+                left_col,
+                right_col,
+                tolerance,
+                shifted_timestamps(right_col, lag_unit, step),
+                [0],
+            )
+            if correlations is not None:
+                return correlations[0]
+        left_timestamps, left_values = arrays[left_col]
+        right_values = arrays[right_col][1]
+        left_pos, right_pos = align_nearest(
+            left_timestamps,
+            shifted_timestamps(right_col, lag_unit, step),
+            tolerance=tolerance,
+        )
+        if len(left_pos) < 2:
+            return np.nan
+        if method == CorrelationMethod.spearman:
+            return pearson(
+                overlap_ranks(left_values, rank_order(left_col), left_pos),
+                overlap_ranks(right_values, rank_order(right_col), right_pos),
+            )
+        if method == CorrelationMethod.kendall:
+            from scipy.stats import kendalltau
+
+            return kendalltau(left_values[left_pos], right_values[right_pos]).statistic
+        return pearson(left_values[left_pos], right_values[right_pos])
+
+    def lag_key(lag_unit, step):
+        return ("fixed", 0) if lag_unit is None else lag_offset_key(lag_unit, step)
+
+    def left_sample(col, size):
+        if (col, size) not in samples:
+            if col in mapped:
+                timestamps, values = mapped[col].timestamps, mapped[col].values
+            else:
+                timestamps, values = arrays[col]
+            positions = sample_positions(col, len(timestamps), size)
+            samples[(col, size)] = (
+                np.asarray(timestamps[positions]),
+                np.asarray(values[positions]),
+            )
+        return samples[(col, size)]
+
+    def approximate_correlation(left_col, right_col, tolerance, lag_unit=None, step=0):
+        """
+        Estimates the correlation from growing samples of the left series until its
+        confidence interval no longer crosses the threshold, and records the interval.
+        """
+        if left_col in mapped:
+            length = mapped[left_col].data_size
+            right_timestamps, right_values, offset = mapped_shift(
+                right_col, lag_unit, step
+            )
+            right_sorted = True
+        elif lag_unit in (LagUnit.months, LagUnit.years):
+            length = len(arrays[left_col][0])
+            right_timestamps = shifted_timestamps(right_col, lag_unit, step)
+            right_values, offset = arrays[right_col][1], 0
+            right_sorted = False  # local calendar shifts can reorder (DST)
+        else:
+            length = len(arrays[left_col][0])
+            right_timestamps, right_values = arrays[right_col]
+            offset = 0 if lag_unit is None else make_offset(lag_unit, step).value
+            right_sorted = True
+
+        for size in sample_sizes(length):
+            if size >= length:
+                correlation = lagged_correlation(
+                    left_col, right_col, tolerance, lag_unit, step
+                )
+                interval = None if pd.isna(correlation) else (correlation, correlation)
+                break
+            timestamps, values = left_sample(left_col, size)
+            # Matching left - offset is the same as matching left against right + offset
+            left_pos, right_pos = align_nearest(
+                timestamps - offset,
+                right_timestamps,
+                tolerance=tolerance,
+                assume_sorted=right_sorted,
+            )
+            correlation = sample_correlation(
+                values[left_pos], np.asarray(right_values[right_pos]), method
+            )
+            interval = confidence_interval(
+                correlation, len(left_pos), method, request.confidence_level
+            )
+            if interval is None:
+                if len(left_pos) >= min_sample_matches:
+                    break  # no variance in the overlap
+            elif not crosses_threshold(interval, request.approximate_threshold):
+                break
+        sample_stats[(left_col, right_col, lag_key(lag_unit, step))] = (
+            interval,
+            size,
+        )
+        return correlation
+
+    def approximation(left_col, right_col, lag_unit=None, step=0):
+        """The confidence interval and sample size of a correlation, if approximate."""
+        if not request.approximate:
+            return {}
+        interval, size = sample_stats[(left_col, right_col, lag_key(lag_unit, step))]
+        return {
+            "confidence_interval": (
+                None if interval is None else [round(float(v), 4) for v in interval]
+            ),
+            "sample_size": size,
+        }
+
+    estimated_correlation = (
+        approximate_correlation if request.approximate else lagged_correlation
+    )
+
+    def aligned_samples(left_col, right_col, tolerance, lag_unit=None, step=0):
+        """(timestamps, left values, right values) of the matches at one lag."""
+        if left_col not in mapped:
+            left_timestamps, left_values = arrays[left_col]
+            left_pos, right_pos = align_nearest(
+                left_timestamps,
+                shifted_timestamps(right_col, lag_unit, step),
+                tolerance=tolerance,
+            )
+            return (
+                left_timestamps[left_pos],
+                left_values[left_pos],
+                arrays[right_col][1][right_pos],
+            )
+
+        left = mapped[left_col]
+        right_timestamps, right_values, offset = mapped_shift(right_col, lag_unit, step)
+        stride = max(1, int(np.ceil(left.data_size / aligned_max_points)))
+        parts = []
+        for block_offset, left_timestamps, left_values in left.blocks():
+            left_pos, right_pos = align_nearest(
+                left_timestamps - offset,
+                right_timestamps,
+                tolerance=tolerance,
+                assume_sorted=True,
+            )
+            keep = (block_offset + left_pos) % stride == 0
+            left_pos, right_pos = left_pos[keep], right_pos[keep]
+            parts.append(
+                (
+                    left_timestamps[left_pos],
+                    left_values[left_pos],
+                    np.asarray(right_values[right_pos]),
+                )
+            )
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        return tuple(np.concatenate(columns) for columns in zip(*parts))
+
+    def aligned_pair(df_info1, df_info2, details):
+        """{"zero_lag": AlignedPair, "best_lag": AlignedPair} of a pair's results."""
+        col1, col2 = df_info1.name, df_info2.name
+        best_lag_unit, best_lag = details["best_lag_unit"], details["best_lag"]
+        if best_lag_unit is None or best_lag == 0:
+            best_lag_unit, best_lag = None, 0
+
+        if request.lags:
+            zero_lag_correlation = next(
+                (
+                    entry["correlation"]
+                    for entry in details["lag_details"]
+                    if entry["lag_step"] == 0
+                ),
+                None,
+            )
+        else:
+            zero_lag_correlation = details["best_correlation"]
+        if zero_lag_correlation is not None and np.isnan(zero_lag_correlation):
+            zero_lag_correlation = None
+
+        # Mirrored results were computed from the matches of the reversed pair at the
+        # negated lag, copied ones at the same lag; any other pair is aligned with its
+        # own left/right roles
+        reverse = aligned.get((col2, col1))
+        reverse_step = None
+        if (col1, col2) in mirrored:
+            reverse_step = -best_lag
+        elif (col1, col2) in copied:
+            reverse_step = best_lag
+        if (
+            reverse_step is not None
+            and reverse is not None
+            and reverse["best_lag"].lag_unit == best_lag_unit
+            and reverse["best_lag"].lag_step == reverse_step
+        ):
+            return {
+                "zero_lag": reverse["zero_lag"].swapped(0, zero_lag_correlation),
+                "best_lag": reverse["best_lag"].swapped(
+                    best_lag, details["best_correlation"]
+                ),
+            }
+
+        left_info, right_info, tolerance = order_by_frequency(df_info1, df_info2)
+
+        def aligned_at(lag_unit, step, correlation):
+            timestamps, left_values, right_values = aligned_samples(
+                left_info.name, right_info.name, tolerance, lag_unit, step
+            )
+            if left_info.name != col1:
+                left_values, right_values = right_values, left_values
+            return AlignedPair(
+                columns=(col1, col2),
+                lag_unit=lag_unit,
+                lag_step=step,
+                correlation=correlation,
+                timestamps=timestamps,
+                values1=left_values,
+                values2=right_values,
+            )
+
+        zero_lag = aligned_at(None, 0, zero_lag_correlation)
+        if best_lag_unit is None:
+            return {"zero_lag": zero_lag, "best_lag": zero_lag}
+        return {
+            "zero_lag": zero_lag,
+            "best_lag": aligned_at(
+                best_lag_unit, best_lag, details["best_correlation"]
+            ),
         }
-        # If freq is e.g. '15T' => 15 minutes, try parsing
-        if freq.endswith("T"):  # e.g. '15T'
-            try:
-                mins = int(freq.replace("T", ""))
-                return pd.Timedelta(minutes=mins)
-            except ValueError:
-                pass
-        return freq_map.get(freq, None)
 
     for i, df_info1 in enumerate(data_frame_infos):
         for j, df_info2 in enumerate(data_frame_infos):
-            col1 = df_info1.dataframe.columns[0]
-            col2 = df_info2.dataframe.columns[0]
+            col1 = df_info1.name
+            col2 = df_info2.name
 
-            # Determine which DF is "higher frequency" (smaller time delta)
-            freq1 = frequency_to_timedelta(df_info1.frequency)
-            freq2 = frequency_to_timedelta(df_info2.frequency)
-
-            if freq1 is not None and freq2 is not None:
-                if freq1 < freq2:
-                    left_df = df_info1.dataframe
-                    right_df = df_info2.dataframe
-                    tolerance = freq1
+            if pairs is not None and (col1, col2) not in pairs:
+                continue
+
+            if prune_symmetric_pairs and j < i and (col2, col1) in correlation_details:
+                reverse_details = correlation_details[(col2, col1)]
+                if swaps_roles(df_info1, df_info2):
+                    correlation_details[(col1, col2)] = mirror_correlation(
+                        reverse_details
+                    )
+                    mirrored.add((col1, col2))
                 else:
-                    left_df = df_info2.dataframe
-                    right_df = df_info1.dataframe
-                    tolerance = freq2
-            else:
-                # Fallback if we can't parse frequencies
-                left_df = df_info1.dataframe
-                right_df = df_info2.dataframe
-                tolerance = None
+                    # Both orders correlate the same left and right series
+                    correlation_details[(col1, col2)] = dict(reverse_details)
+                    copied.add((col1, col2))
+                continue
+
+            cache_key = pair_cache_key(
+                fingerprints[i],
+                fingerprints[j],
+                request.lags,
+                method,
+                lag_stride,
+                approximate_key(request),
+            )
+            cached = correlation_cache.get(cache_key)
+            if cached is not None:
+                correlation_details[(col1, col2)] = cached
+                continue
 
-            # If no lags, do a single "merge_asof" nearest match
+            # Determine which DF is "higher frequency" (smaller time delta)
+            left_info, right_info, tolerance = order_by_frequency(df_info1, df_info2)
+            left_col = left_info.name
+            right_col = right_info.name
+
+            # If no lags, do a single nearest match
             if not request.lags:
-                merged = merge_with_nearest(left_df, right_df, tolerance=tolerance)
-                if merged.shape[0] > 1:
+                current_corr = estimated_correlation(left_col, right_col, tolerance)
+                if pd.notna(current_corr):
                     # Round the correlation
-                    best_correlation = round(merged.corr().iloc[0, 1], 4)
+                    best_correlation = round(current_corr, 4)
                 else:
                     best_correlation = np.nan
 
                 best_lag = 0
                 best_lag_unit = None
                 lag_details = []
+                best_approximation = approximation(left_col, right_col)
 
             else:
                 best_correlation = None
                 best_lag = 0
                 best_lag_unit = None
                 lag_details = []
+                best_approximation = {}
+                if request.approximate:
+                    best_approximation = {
+                        "confidence_interval": None,
+                        "sample_size": None,
+                    }
+
+                # Equal absolute offsets (e.g. {"hours": 48} and {"days": 2}, or step 0
+                # of every unit) are evaluated once per pair and fanned out to each unit
+                offset_correlations = {}
+
+                def correlation_at(lag_unit, step):
+                    offset_key = lag_offset_key(lag_unit, step)
+                    if offset_key not in offset_correlations:
+                        offset_correlations[offset_key] = estimated_correlation(
+                            left_col, right_col, tolerance, lag_unit, step
+                        )
+                    return offset_correlations[offset_key]
 
                 for lag_dict in request.lags:
                     # Example lag_dict might be {"hours": 10} or {"days": 3}
                     for lag_unit, lag_value in lag_dict.items():
-                        # We'll sweep from -lag_value to +lag_value
-                        for step in range(-lag_value, lag_value + 1):
-                            # Shift the 'right_df'
-                            right_shifted = right_df.copy()
-                            offset = make_offset(lag_unit, step)
-                            right_shifted.index = right_shifted.index + offset
-
-                            merged = merge_with_nearest(
-                                left_df, right_shifted, tolerance=tolerance
+                        if (
+                            lag_stride == 1
+                            and not request.approximate
+                            and use_kernel(left_col, right_col)
+                            and lag_unit not in (LagUnit.months, LagUnit.years)
+                        ):
+                            # Fixed-unit sweeps run all their steps in one kernel call
+                            steps = [
+                                step
+                                for step in range(-lag_value, lag_value + 1)
+                                if lag_offset_key(lag_unit, step)
+                                not in offset_correlations
+                            ]
+                            correlations = kernel_correlations(
+                                left_col,
+                                right_col,
+                                tolerance,
+                                arrays[right_col][0],
+                                [make_offset(lag_unit, step).value for step in steps],
                             )
-                            if merged.shape[0] < 2:
-                                current_corr = np.nan
-                            else:
-                                current_corr = merged.corr().iloc[0, 1]
+                            if correlations is not None:
+                                for step, correlation in zip(steps, correlations):
+                                    offset_key = lag_offset_key(lag_unit, step)
+                                    offset_correlations[offset_key] = correlation
 
+                        # We'll sweep from -lag_value to +lag_value, shifting the
+                        # right series and matching it to the left one
+                        correlations_by_step = sweep_lag_steps(
+                            lag_value,
+                            lag_stride,
+                            lambda step: correlation_at(lag_unit, step),
+                        )
+                        for step, current_corr in correlations_by_step.items():
                             # Only store details if correlation is not null
                             if pd.notna(current_corr):
                                 corr_rounded = round(current_corr, 4)  # <-- round here
@@ -206,6 +857,9 @@ def compute_correlation(data_frame_infos, request: CorrelationRequest):
                                         "lag_unit": lag_unit,
                                         "lag_step": step,
                                         "correlation": float(corr_rounded),
+                                        **approximation(
+                                            left_col, right_col, lag_unit, step
+                                        ),
                                     }
                                 )
 
@@ -216,6 +870,9 @@ def compute_correlation(data_frame_infos, request: CorrelationRequest):
                                     best_correlation = corr_rounded
                                     best_lag = step
                                     best_lag_unit = lag_unit
+                                    best_approximation = approximation(
+                                        left_col, right_col, lag_unit, step
+                                    )
 
             correlation_details[(col1, col2)] = {
                 "best_correlation": (
@@ -224,11 +881,249 @@ def compute_correlation(data_frame_infos, request: CorrelationRequest):
                 "best_lag": best_lag,
                 "best_lag_unit": best_lag_unit,
                 "lag_details": lag_details,
+                **best_approximation,
             }
+            correlation_cache.put(cache_key, correlation_details[(col1, col2)])
 
     correlations = convert_correlations_to_dict(correlation_details)
     print("correlations", correlations)
-    return correlations
+    if not return_aligned:
+        return correlations
+
+    infos_by_name = {info.name: info for info in data_frame_infos}
+    for (col1, col2), details in correlation_details.items():
+        if col1 != col2:
+            aligned[(col1, col2)] = aligned_pair(
+                infos_by_name[col1], infos_by_name[col2], details
+            )
+    return correlations, {
+        f"{col1} and {col2}": pair for (col1, col2), pair in aligned.items()
+    }
+
+
+def select_pairs(data_frame_infos, grouping, reference=None):
+    """
+    The (name1, name2) pairs to correlate for a ChildrenGrouping, None for all pairs.
+    within_group pairs the attributes of each asset among themselves, reference pairs
+    the 'reference' AssetAttribute with every other series.
+    """
+    grouping = ChildrenGrouping(grouping)
+    if grouping == ChildrenGrouping.all:
+        return None
+    names = [info.name for info in data_frame_infos]
+    if grouping == ChildrenGrouping.within_group:
+        # Series are named "<asset_id>_<attribute_name>"
+        asset_of = {name: name.split("_", 1)[0] for name in names}
+        return {(a, b) for a in names for b in names if asset_of[a] == asset_of[b]}
+
+    if reference is None or not reference.attribute_name:
+        raise ValueError("The reference grouping needs a reference attribute_name.")
+    reference_name = f"{reference.asset_id}_{reference.attribute_name}"
+    if reference_name not in names:
+        raise ValueError(f"No data for the reference attribute {reference_name}.")
+    return {(reference_name, name) for name in names if name != reference_name}
+
+
+def sweep_lag_steps(lag_value: int, lag_stride: int, correlation_at):
+    """
+    Returns {step: correlation} for the steps -lag_value..lag_value in ascending order.
+    With lag_stride > 1 only every lag_stride-th step (and both ends) is evaluated,
+    followed by all steps around the best coarse step.
+    """
+    steps = list(range(-lag_value, lag_value + 1, lag_stride))
+    if steps[-1] != lag_value:
+        steps.append(lag_value)
+    correlations = {step: correlation_at(step) for step in steps}
+
+    if lag_stride > 1:
+        valid = {step: corr for step, corr in correlations.items() if pd.notna(corr)}
+        if valid:
+            best = max(valid, key=lambda step: abs(valid[step]))
+            for step in range(
+                max(-lag_value, best - lag_stride + 1),
+                min(lag_value, best + lag_stride - 1) + 1,
+            ):
+                if step not in correlations:
+                    correlations[step] = correlation_at(step)
+    return dict(sorted(correlations.items()))
+
+
+def mirror_correlation(details):
+    """
+    Result of the reversed pair: shifting one series forward equals shifting the other
+    one backward, so the lags are negated (keeping each sweep in ascending order).
+    """
+    runs = []
+    for entry in details["lag_details"]:
+        previous = runs[-1][-1] if runs else None
+        if (
+            previous is None
+            or entry["lag_unit"] != previous["lag_unit"]
+            or -entry["lag_step"] >= previous["lag_step"]
+        ):
+            runs.append([])
+        runs[-1].append({**entry, "lag_step": -entry["lag_step"]})
+    return {
+        **details,
+        "best_lag": -details["best_lag"],
+        "lag_details": [entry for run in runs for entry in reversed(run)],
+    }
+
+
+def series_arrays(df: pd.DataFrame):
+    """
+    Returns a single-column DataFrame as (timestamps, values) NumPy arrays sorted by time,
+    with timestamps as int64 nanoseconds since the epoch (UTC).
+    """
+    timestamps = df.index.as_unit("ns").asi8
+    values = df.iloc[:, 0].to_numpy(dtype=float)
+    if not df.index.is_monotonic_increasing:
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+    return timestamps, values
+
+
+def align_nearest(
+    left_timestamps: np.ndarray,
+    right_timestamps: np.ndarray,
+    tolerance: Optional[pd.Timedelta] = None,
+    assume_sorted: bool = False,
+):
+    """
+    Positional equivalent of merge_with_nearest on int64 timestamp arrays. Every left
+    timestamp is matched to the nearest right timestamp (ties resolve backward, like
+    merge_asof) within the tolerance. 'left_timestamps' must be sorted, pass
+    assume_sorted=True to skip the order check of 'right_timestamps'.
+
+    Returns (left_positions, right_positions) of the matched rows.
+    """
+    if len(left_timestamps) == 0 or len(right_timestamps) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    right_order = None
+    if not assume_sorted and np.any(right_timestamps[1:] < right_timestamps[:-1]):
+        right_order = np.argsort(right_timestamps, kind="stable")
+        right_timestamps = right_timestamps[right_order]
+
+    last = len(right_timestamps) - 1
+    no_match = np.iinfo(np.int64).max
+    backward = np.searchsorted(right_timestamps, left_timestamps, side="right") - 1
+    forward = np.searchsorted(right_timestamps, left_timestamps, side="left")
+    backward_distance = np.where(
+        backward >= 0,
+        left_timestamps - right_timestamps[np.maximum(backward, 0)],
+        no_match,
+    )
+    forward_distance = np.where(
+        forward <= last,
+        right_timestamps[np.minimum(forward, last)] - left_timestamps,
+        no_match,
+    )
+
+    use_forward = forward_distance < backward_distance
+    right_positions = np.where(use_forward, forward, backward)
+    distance = np.where(use_forward, forward_distance, backward_distance)
+    if tolerance is not None:
+        matched = distance <= pd.Timedelta(tolerance).value
+    else:
+        matched = distance != no_match
+
+    left_positions = np.flatnonzero(matched)
+    right_positions = right_positions[matched]
+    if right_order is not None:
+        right_positions = right_order[right_positions]
+    return left_positions, right_positions
+
+
+def sample_correlation(x: np.ndarray, y: np.ndarray, method) -> float:
+    """Correlation of two aligned samples with a CorrelationMethod."""
+    if len(x) < 2:
+        return np.nan
+    if method == CorrelationMethod.spearman:
+        from scipy.stats import rankdata
+
+        return pearson(rankdata(x), rankdata(y))
+    if method == CorrelationMethod.kendall:
+        from scipy.stats import kendalltau
+
+        return kendalltau(x, y).statistic
+    return pearson(x, y)
+
+
+def pearson(x: np.ndarray, y: np.ndarray) -> float:
+    """Pearson correlation of two aligned arrays, NaN for fewer than two samples or no variance."""
+    if len(x) < 2:
+        return np.nan
+    x = x - x.mean()
+    y = y - y.mean()
+    denominator = np.sqrt(np.dot(x, x) * np.dot(y, y))
+    if denominator == 0:
+        return np.nan
+    return float(np.clip(np.dot(x, y) / denominator, -1.0, 1.0))
+
+
+def blocked_pearson(
+    left_info,
+    right_timestamps: np.ndarray,
+    right_values: np.ndarray,
+    offset: int,
+    tolerance: Optional[pd.Timedelta],
+    left_mean: float,
+    right_mean: float,
+) -> float:
+    """
+    Pearson correlation of a memory-mapped series with the right series 'right_values'
+    at 'right_timestamps' (sorted, possibly calendar-shifted), matched like
+    align_nearest with the right timestamps moved by 'offset' nanoseconds.
+    Only one block of the left series and its matches are in memory at a time. The sums
+    are accumulated around the series means to keep them numerically stable.
+    """
+    n = 0
+    sums = np.zeros(5)
+    for _, left_timestamps, left_values in left_info.blocks():
+        # Matching left - offset against right is the same as left against right + offset
+        left_pos, right_pos = align_nearest(
+            left_timestamps - offset,
+            right_timestamps,
+            tolerance=tolerance,
+            assume_sorted=True,
+        )
+        if len(left_pos) == 0:
+            continue
+        x = left_values[left_pos] - left_mean
+        y = np.asarray(right_values[right_pos]) - right_mean
+        n += len(x)
+        sums += (x.sum(), y.sum(), np.dot(x, x), np.dot(y, y), np.dot(x, y))
+
+    if n < 2:
+        return np.nan
+    sum_x, sum_y, sum_xx, sum_yy, sum_xy = sums
+    cov = sum_xy - sum_x * sum_y / n
+    var_x = sum_xx - sum_x**2 / n
+    var_y = sum_yy - sum_y**2 / n
+    if var_x <= 0 or var_y <= 0:
+        return np.nan
+    return float(np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0))
+
+
+def overlap_ranks(values: np.ndarray, order: np.ndarray, positions: np.ndarray):
+    """
+    Average ranks (ties share their mean rank) of values[positions] within that overlap.
+    Uses the series' precomputed sort order, so ranking an overlap is O(n) instead of
+    a new sort. Repeated positions count as separate observations.
+    """
+    if len(positions) == 0:
+        return np.empty(0)
+    counts = np.bincount(positions, minlength=len(values))[order]
+    sorted_values = values[order]
+    group_starts = np.flatnonzero(
+        np.concatenate(([True], sorted_values[1:] != sorted_values[:-1]))
+    )
+    group_counts = np.add.reduceat(counts, group_starts)
+    group_ranks = np.cumsum(group_counts) - group_counts + (group_counts + 1) / 2
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(group_ranks, np.diff(np.append(group_starts, len(values))))
+    return ranks[positions]
 
 
 def merge_with_nearest(
@@ -258,6 +1153,91 @@ def merge_with_nearest(
     return merged
 
 
+def compute_rolling_correlation(
+    df_info1: DataFrameInfo,
+    df_info2: DataFrameInfo,
+    window: Dict[LagUnit, int],
+    lag: Optional[Dict[LagUnit, int]] = None,
+    max_points: Optional[int] = None,
+):
+    """
+    Computes a rolling Pearson correlation between two series over a time-based window
+    (e.g. {"days": 7}). The series are aligned once with the same nearest-match logic as
+    compute_correlation (optionally with a fixed lag applied to the lower-frequency series),
+    then every window is evaluated from cumulative sums, so the cost is O(n) regardless
+    of the window length.
+
+    If max_points is given, the output is downsampled to at most that many points.
+    Correlation values are rounded to 4 decimal places, windows with fewer than two
+    samples or without variance yield None.
+    """
+    col1 = df_info1.name
+    col2 = df_info2.name
+    left_info, right_info, tolerance = order_by_frequency(df_info1, df_info2)
+    left_df, right_df = left_info.dataframe, right_info.dataframe
+
+    if lag:
+        lag_unit, lag_step = next(iter(lag.items()))
+        right_df = right_df.copy(deep=False)
+        right_df.index = shift_index(right_df.index, lag_unit, lag_step)
+
+    merged = merge_with_nearest(left_df, right_df, tolerance=tolerance)
+
+    window_unit, window_value = next(iter(window.items()))
+    timestamps = merged.index
+    window_starts = timestamps.searchsorted(
+        shift_index(timestamps, window_unit, -window_value), side="right"
+    )
+    window_ends = np.arange(1, len(timestamps) + 1)
+
+    # Centre the data first to keep the cumulative sums numerically stable
+    x = merged[col1].to_numpy(dtype=float)
+    y = merged[col2].to_numpy(dtype=float)
+    if len(x):
+        x = x - x.mean()
+        y = y - y.mean()
+
+    def cumulative_sum(values):
+        return np.concatenate(([0.0], np.cumsum(values)))
+
+    def window_sum(cumulative):
+        return cumulative[window_ends] - cumulative[window_starts]
+
+    n = (window_ends - window_starts).astype(float)
+    cumulative_xx, cumulative_yy = cumulative_sum(x * x), cumulative_sum(y * y)
+    sum_x, sum_y = window_sum(cumulative_sum(x)), window_sum(cumulative_sum(y))
+    cov = n * window_sum(cumulative_sum(x * y)) - sum_x * sum_y
+    var_x = n * window_sum(cumulative_xx) - sum_x**2
+    var_y = n * window_sum(cumulative_yy) - sum_y**2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rolling = cov / np.sqrt(var_x * var_y)
+    # The differences of cumulative sums keep a rounding residue relative to the sums
+    # up to the window end, so windows without variance rarely come out exactly 0
+    no_variance_x = var_x <= min_variance * n * cumulative_xx[window_ends]
+    no_variance_y = var_y <= min_variance * n * cumulative_yy[window_ends]
+    rolling[(n < 2) | no_variance_x | no_variance_y] = np.nan
+    rolling = np.clip(rolling, -1.0, 1.0)
+
+    if max_points and len(rolling) > max_points:
+        stride = int(np.ceil(len(rolling) / max_points))
+        # Keep the most recent window in the output
+        keep = np.arange(len(rolling) - 1, -1, -stride)[::-1]
+        timestamps = timestamps[keep]
+        rolling = rolling[keep]
+
+    return {
+        "columns": [col1, col2],
+        "window": window,
+        "lag": lag,
+        "samples": int(len(merged)),
+        "timestamps": [ts.isoformat() for ts in timestamps],
+        "correlation": [
+            None if np.isnan(value) else round(float(value), 4) for value in rolling
+        ],
+    }
+
+
 def convert_correlations_to_dict(correlations):
     """
     Converts the internal correlation_details dictionary into a user-friendly dictionary.
@@ -270,5 +1250,8 @@ def convert_correlations_to_dict(correlations):
             "lag_unit": info["best_lag_unit"],
             "lag_details": info["lag_details"],
         }
+        # Approximate results (see compute_correlation) carry their uncertainty
+        for key in ("confidence_interval", "sample_size"):
+            if key in info:
+                result[f"{col1} and {col2}"][key] = info[key]
     return result
-
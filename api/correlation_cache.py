@@ -0,0 +1,153 @@
+import copy
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from api.models import CorrelationMethod, LagUnit
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+
+class CorrelationCache:
+    """
+    Thread-safe, size-bounded LRU cache for per-pair correlation results.
+
+    Keys are built with pair_cache_key() from the fingerprints of both series and the
+    normalized lag spec, so overlapping requests reuse the pairs they have in common.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = copy.deepcopy(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, asset_id=None):
+        """
+        Drops all cached pairs involving the given asset, or everything if asset_id is None.
+        Returns the number of removed entries.
+        """
+        with self._lock:
+            if asset_id is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [
+                    key for key in self._entries if asset_id in (key[0][0], key[1][0])
+                ]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+        logger.info(f"Invalidated {removed} cached correlation pairs")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def series_fingerprint(df_info):
+    """
+    Identifies a single-column series by asset, attribute, covered time range and a hash
+    of its timestamps and values.
+    """
+    asset_id, _, attribute_name = df_info.name.partition("_")
+    if hasattr(df_info, "dataframe"):
+        data_hash = hashlib.blake2b(
+            pd.util.hash_pandas_object(df_info.dataframe, index=True)
+            .to_numpy()
+            .tobytes(),
+            digest_size=16,
+        ).hexdigest()
+    else:
+        # Memory-mapped series (api.series_store) are hashed block by block
+        digest = hashlib.blake2b(digest_size=16)
+        for _, timestamps, values in df_info.blocks():
+            digest.update(timestamps.tobytes())
+            digest.update(values.tobytes())
+        data_hash = digest.hexdigest()
+    return (
+        int(asset_id) if asset_id.isdigit() else asset_id,
+        attribute_name,
+        df_info.start_date.isoformat() if df_info.start_date is not None else None,
+        df_info.end_date.isoformat() if df_info.end_date is not None else None,
+        data_hash,
+    )
+
+
+def normalize_lag_spec(lags):
+    """Turns request.lags into a hashable tuple, keeping the order that drives lag_details."""
+    if not lags:
+        return ()
+    return tuple(
+        (LagUnit(lag_unit).value, int(lag_value))
+        for lag_dict in lags
+        for lag_unit, lag_value in lag_dict.items()
+    )
+
+
+def lag_offset_key(lag_unit, step: int):
+    """
+    Absolute offset of a lag step. Steps with equal keys shift a series identically,
+    e.g. {"hours": 48} and {"days": 2}, {"years": 1} and {"months": 12}, or step 0 of
+    every unit.
+    """
+    lag_unit = LagUnit(lag_unit)
+    if step == 0:
+        return ("fixed", 0)
+    if lag_unit == LagUnit.months:
+        return ("months", step)
+    if lag_unit == LagUnit.years:
+        return ("months", 12 * step)
+    return ("fixed", pd.Timedelta(**{lag_unit.value: step}).value)
+
+
+def pair_cache_key(
+    fingerprint1, fingerprint2, lags, method="pearson", lag_stride=1, approximate=None
+):
+    """'approximate' is the approximate_key() of the request, None for exact results."""
+    return (
+        fingerprint1,
+        fingerprint2,
+        normalize_lag_spec(lags),
+        int(lag_stride),
+        CorrelationMethod(method).value,
+        approximate,
+    )
+
+
+correlation_cache = CorrelationCache(
+    max_entries=int(os.getenv("CORRELATION_CACHE_SIZE", 10000))
+)
@@ -0,0 +1,171 @@
+import logging
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from api.models import LagUnit
+from api.series_store import memory_budget_bytes
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+# Set to false to always correlate pair by pair
+use_grid = os.getenv("CORRELATION_GRID_ENGINE", "true").lower() in ("1", "true", "yes")
+# Peak bytes per grid cell (padded time step x series x [mask, value, value²]) while
+# building it: the left- and right-hand float64 matrices and the boolean fill masks
+grid_cell_bytes = 18
+# Largest grid built for a request, by default what fits CORRELATION_MEMORY_BUDGET_MB
+grid_max_cells = int(
+    os.getenv("CORRELATION_GRID_MAX_CELLS", memory_budget_bytes // grid_cell_bytes)
+)
+
+# Overlaps whose variance (relative to the standardized series) is below this are
+# treated as constant, like pearson() does for a zero variance
+min_variance = 1e-12
+
+
+class CorrelationGrid:
+    """
+    All series of a request on one regular time grid, for computing the lagged Pearson
+    correlations of all pairs at once.
+
+    Every series is standardized and placed on the grid with a mask of its samples. As
+    the right-hand series of a pair, empty grid points take the nearest sample within
+    one grid step (the previous one on ties), which is exactly what align_nearest
+    matches with the grid step as tolerance. Shifting the right-hand series by k grid
+    steps is a slice, so the matched counts, sums, sums of squares and cross products
+    of all N x N pairs at one lag come from a single matrix multiply. The resulting
+    N x N correlation slices are computed on demand and kept per lag.
+    """
+
+    def __init__(self, arrays: Dict[str, tuple], step: int, max_shift: int):
+        self.step = step
+        self.max_shift = max_shift
+        self.columns = {name: i for i, name in enumerate(arrays)}
+        self._slices = {}
+
+        start = min(
+            timestamps[0] for timestamps, _ in arrays.values() if len(timestamps)
+        )
+        end = max(
+            timestamps[-1] for timestamps, _ in arrays.values() if len(timestamps)
+        )
+        self.length = length = int((end - start) // step) + 1
+        n = len(arrays)
+
+        # Left-hand side, transposed: [mask, values, values²] of every series, no filling
+        left_t = np.zeros((3 * n, length))
+        # Right-hand side: the same padded by max_shift steps and nearest-filled. Both are
+        # filled in place, so they are the only grid-sized float arrays (grid_cell_bytes)
+        padded = length + 2 * max_shift
+        right = np.zeros((padded, 3 * n))
+        right_mask = np.zeros((padded, n), dtype=bool)
+        right_values = right[:, n : 2 * n]
+        for i, (timestamps, values) in enumerate(arrays.values()):
+            if len(values) == 0:
+                continue
+            std = values.std()
+            standardized = (values - values.mean()) / (std if std > 0 else 1.0)
+            positions = ((timestamps - start) // step).astype(np.intp)
+            left_t[i, positions] = 1.0
+            left_t[n + i, positions] = standardized
+            left_t[2 * n + i, positions] = standardized**2
+            right_mask[positions + max_shift, i] = True
+            right_values[positions + max_shift, i] = standardized
+
+        filled_mask = right_mask.copy()
+        # Previous sample one step back first (ties resolve backward), then the next one
+        backward = ~right_mask[1:] & right_mask[:-1]
+        right_values[1:][backward] = right_values[:-1][backward]
+        filled_mask[1:] |= backward
+        del backward
+        forward = ~filled_mask[:-1] & right_mask[1:]
+        right_values[:-1][forward] = right_values[1:][forward]
+        filled_mask[:-1] |= forward
+        del forward, right_mask
+
+        right[:, :n] = filled_mask
+        np.square(right_values, out=right[:, 2 * n :])
+        self._left_t = left_t
+        self._right = right
+        self._n = n
+
+    @classmethod
+    def build(cls, arrays, frequencies, max_offset: int):
+        """
+        Returns a grid for the series {name: (timestamps, values)} if they all share one
+        fixed frequency (pd.Timedelta or None per series), have unique timestamps on a
+        common grid of it and fit into CORRELATION_GRID_MAX_CELLS (by default derived
+        from CORRELATION_MEMORY_BUDGET_MB) together with the cached lag slices,
+        otherwise None.
+        'max_offset' is the largest absolute lag in nanoseconds.
+        """
+        if not use_grid or len(arrays) < 2 or len(set(frequencies)) != 1:
+            return None
+        frequency = frequencies[0]
+        if frequency is None or frequency.value <= 0:
+            return None
+        step = frequency.value
+        non_empty = [ts for ts, _ in arrays.values() if len(ts)]
+        if not non_empty:
+            return None
+        origin = non_empty[0][0]
+        for timestamps in non_empty:
+            if np.any(np.diff(timestamps) <= 0) or np.any((timestamps - origin) % step):
+                return None
+
+        max_shift = int(max_offset // step)
+        length = (
+            max(ts[-1] for ts in non_empty) - min(ts[0] for ts in non_empty)
+        ) // step
+        n = len(arrays)
+        # lag_slice keeps an N x N float64 slice per shift, counted in grid cells too
+        slice_cells = -(-n * n * 8 * (2 * max_shift + 1) // grid_cell_bytes)
+        if (length + 1 + 2 * max_shift) * n * 3 + slice_cells > grid_max_cells:
+            logger.info("Series exceed CORRELATION_GRID_MAX_CELLS, not using the grid")
+            return None
+        return cls(arrays, step, max_shift)
+
+    def lag_slice(self, shift: int) -> np.ndarray:
+        """N x N correlations [left, right] with the right series moved by 'shift' steps."""
+        if shift not in self._slices:
+            n, start = self._n, self.max_shift - shift
+            products = self._left_t @ self._right[start : start + self.length]
+            count, sum_y, sum_yy = (products[:n, k * n : (k + 1) * n] for k in range(3))
+            sum_x, sum_xy = products[n : 2 * n, :n], products[n : 2 * n, n : 2 * n]
+            sum_xx = products[2 * n :, :n]
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cov = count * sum_xy - sum_x * sum_y
+                var_x = count * sum_xx - sum_x**2
+                var_y = count * sum_yy - sum_y**2
+                correlations = np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0)
+            threshold = min_variance * count**2
+            invalid = (count < 2) | (var_x <= threshold) | (var_y <= threshold)
+            correlations[invalid] = np.nan
+            self._slices[shift] = correlations
+        return self._slices[shift]
+
+    def correlation(self, left: str, right: str, offset: int) -> Optional[float]:
+        """
+        Correlation of 'left' with 'right' moved by 'offset' nanoseconds, or None if the
+        offset is not a multiple of the grid step within the prepared range.
+        """
+        shift, remainder = divmod(offset, self.step)
+        if remainder or abs(shift) > self.max_shift:
+            return None
+        return float(self.lag_slice(shift)[self.columns[left], self.columns[right]])
+
+
+def max_fixed_offset(lags) -> int:
+    """Largest absolute lag of the fixed units in a lag spec, in nanoseconds."""
+    offset = 0
+    for lag_dict in lags or []:
+        for lag_unit, lag_value in lag_dict.items():
+            lag_unit = LagUnit(lag_unit)
+            if lag_unit in (LagUnit.months, LagUnit.years):
+                continue
+            offset = max(offset, pd.Timedelta(**{lag_unit.value: lag_value}).value)
+    return offset
@@ -0,0 +1,116 @@
+import logging
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+# Set to false to always use the NumPy alignment even if numba is installed
+use_jit = os.getenv("CORRELATION_JIT", "true").lower() in ("1", "true", "yes")
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def lagged_pearson_kernel(
+    left_timestamps,
+    left_values,
+    right_timestamps,
+    right_values,
+    offsets,
+    tolerance,
+    out,
+):
+    """
+    For every offset k, matches each left timestamp to the nearest right timestamp
+    shifted by offsets[k] (ties resolve backward, 'tolerance' in nanoseconds is
+    inclusive, -1 for none) and writes the Pearson correlation of the matched values to
+    out[k]. Both timestamp arrays must be sorted. The sums are accumulated in one pass
+    with Welford updates, so no temporary arrays are allocated.
+    """
+    n_left = left_timestamps.shape[0]
+    n_right = right_timestamps.shape[0]
+    for k in range(offsets.shape[0]):
+        offset = offsets[k]
+        # Last right position at or before the current left timestamp
+        j = -1
+        n = 0
+        mean_x = 0.0
+        mean_y = 0.0
+        m_xx = 0.0
+        m_yy = 0.0
+        m_xy = 0.0
+        for i in range(n_left):
+            # Matching left - offset against right equals left against right + offset
+            t = left_timestamps[i] - offset
+            while j + 1 < n_right and right_timestamps[j + 1] <= t:
+                j += 1
+            position = -1
+            distance = 0
+            if j >= 0:
+                position = j
+                distance = t - right_timestamps[j]
+            if j + 1 < n_right:
+                forward = right_timestamps[j + 1] - t
+                if position < 0 or forward < distance:
+                    position = j + 1
+                    distance = forward
+            if position < 0 or (tolerance >= 0 and distance > tolerance):
+                continue
+
+            x = left_values[i]
+            y = right_values[position]
+            n += 1
+            dx = x - mean_x
+            dy = y - mean_y
+            mean_x += dx / n
+            mean_y += dy / n
+            m_xx += dx * (x - mean_x)
+            m_yy += dy * (y - mean_y)
+            m_xy += dx * (y - mean_y)
+
+        denominator = np.sqrt(m_xx * m_yy)
+        if n < 2 or denominator == 0:
+            out[k] = np.nan
+        else:
+            out[k] = min(max(m_xy / denominator, -1.0), 1.0)
+
+
+jit_available = numba is not None and use_jit
+if jit_available:
+    lagged_pearson_kernel = numba.njit(cache=True, nogil=True)(lagged_pearson_kernel)
+elif use_jit:
+    logger.info("numba is not installed, using the NumPy correlation path")
+
+
+def lagged_pearson(
+    left_timestamps: np.ndarray,
+    left_values: np.ndarray,
+    right_timestamps: np.ndarray,
+    right_values: np.ndarray,
+    offsets,
+    tolerance: Optional[pd.Timedelta] = None,
+) -> np.ndarray:
+    """
+    Pearson correlations of the nearest-match alignment (see align_nearest) of two sorted
+    int64 nanosecond timestamp series, for each offset in nanoseconds applied to the
+    right series. Runs compiled if numba is installed, otherwise as plain Python (only
+    meant for checking the kernel against the NumPy path on small data).
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    out = np.empty(len(offsets))
+    lagged_pearson_kernel(
+        np.ascontiguousarray(left_timestamps, dtype=np.int64),
+        np.ascontiguousarray(left_values, dtype=np.float64),
+        np.ascontiguousarray(right_timestamps, dtype=np.int64),
+        np.ascontiguousarray(right_values, dtype=np.float64),
+        offsets,
+        -1 if tolerance is None else int(pd.Timedelta(tolerance).value),
+        out,
+    )
+    return out
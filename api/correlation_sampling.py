@@ -0,0 +1,74 @@
+import math
+import os
+import zlib
+from statistics import NormalDist
+
+import numpy as np
+
+from api.models import CorrelationMethod, CorrelationRequest
+
+# Samples of the higher-frequency series a pair starts with in approximate mode
+approximate_sample_size = int(os.getenv("APPROXIMATE_SAMPLE_SIZE", 10_000))
+# Factor by which the sample of an undecided pair grows, up to the whole series
+approximate_growth = max(2, int(os.getenv("APPROXIMATE_GROWTH", 4)))
+# Samples without a valid interval grow until they match at least this many points
+min_sample_matches = 30
+
+# Variance factors of the Fisher z-transform per method (Fieller et al. 1957)
+fisher_variance = {
+    CorrelationMethod.pearson: 1.0,
+    CorrelationMethod.spearman: 1.06,
+    CorrelationMethod.kendall: 0.437,
+}
+
+
+def approximate_key(request: CorrelationRequest):
+    """The approximate settings of a request for cache keys, None if it is exact."""
+    if not request.approximate:
+        return None
+    return (request.approximate_threshold, request.confidence_level)
+
+
+def sample_sizes(length: int):
+    """
+    Sample sizes tried for a series of 'length' samples, growing by APPROXIMATE_GROWTH
+    from APPROXIMATE_SAMPLE_SIZE; the last one is the whole series.
+    """
+    size = max(approximate_sample_size, 1)
+    while size < length:
+        yield size
+        size *= approximate_growth
+    yield length
+
+
+def sample_positions(name: str, length: int, size: int) -> np.ndarray:
+    """
+    Sorted random positions (without replacement) of 'size' of the 'length' samples of
+    a series. Seeded by the series name, so repeated requests draw the same sample.
+    """
+    if size >= length:
+        return np.arange(length)
+    rng = np.random.default_rng(zlib.crc32(name.encode()))
+    return np.sort(rng.choice(length, size, replace=False))
+
+
+def confidence_interval(correlation: float, n: int, method, confidence_level: float):
+    """
+    Confidence interval (low, high) of a correlation estimated from 'n' matched samples,
+    from the Fisher z-transform; None if it is undefined (NaN or too few samples).
+    """
+    method = CorrelationMethod(method)
+    dof = n - (4 if method == CorrelationMethod.kendall else 3)
+    if dof <= 0 or not np.isfinite(correlation):
+        return None
+    z = math.atanh(min(max(correlation, -0.999999), 0.999999))
+    margin = NormalDist().inv_cdf(0.5 + confidence_level / 2) * math.sqrt(
+        fisher_variance[method] / dof
+    )
+    return math.tanh(z - margin), math.tanh(z + margin)
+
+
+def crosses_threshold(interval, threshold: float) -> bool:
+    """Whether an interval leaves open if |correlation| is above the threshold."""
+    low, high = interval
+    return low < threshold < high or low < -threshold < high
@@ -0,0 +1,260 @@
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytz
+
+from api.correlation_cache import lag_offset_key
+from api.correlation_sampling import approximate_sample_size
+from api.models import ChildrenGrouping, CorrelationRequest
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+# One work unit is one sample of one series aligned at one lag step for one pair
+max_work_units = float(os.getenv("CORRELATION_MAX_WORK_UNITS", 1e9))
+max_memory_bytes = float(os.getenv("CORRELATION_MAX_MEMORY_MB", 8192)) * 2**20
+# What to do with requests above the budgets: degrade, queue or reject
+over_budget_action = os.getenv("CORRELATION_OVER_BUDGET_ACTION", "degrade").lower()
+heavy_slots = threading.BoundedSemaphore(
+    int(os.getenv("CORRELATION_HEAVY_CONCURRENCY", 1))
+)
+queue_timeout_seconds = float(os.getenv("CORRELATION_QUEUE_TIMEOUT_SECONDS", 600))
+# Assumptions for assets that have not been fetched before
+default_attributes_per_asset = int(os.getenv("COST_DEFAULT_ATTRIBUTES_PER_ASSET", 5))
+default_frequency_seconds = float(os.getenv("COST_DEFAULT_FREQUENCY_SECONDS", 900))
+
+# Bytes held per sample while a series is in memory (timestamp, value, pandas overhead)
+bytes_per_sample = 32
+# Degraded requests are not resampled below this many samples per series
+min_resampled_samples = 100
+
+# Observed sampling rates (samples per second) by asset and attribute, see record_series
+asset_profiles = {}
+profiles_lock = threading.Lock()
+
+
+class CostBudgetExceeded(Exception):
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+def record_series(asset_id, attribute_name, samples, start_time, end_time):
+    """Records the sampling rate of a fetched series for later estimates."""
+    if start_time is None or end_time is None:
+        return
+    seconds = (end_time - start_time).total_seconds()
+    if seconds <= 0:
+        return
+    with profiles_lock:
+        asset_profiles.setdefault(asset_id, {})[attribute_name] = samples / seconds
+
+
+def series_rates(request: CorrelationRequest):
+    """
+    Expected samples per second of every requested series as (asset_id, rate, known)
+    where 'known' tells whether the rate is known from an earlier fetch of the asset.
+    """
+    rates = []
+    with profiles_lock:
+        for asset in request.assets:
+            profile = asset_profiles.get(asset.asset_id)
+            if profile is None:
+                count = 1 if asset.attribute_name else default_attributes_per_asset
+                rates += [
+                    (asset.asset_id, 1 / default_frequency_seconds, False)
+                ] * count
+            elif asset.attribute_name:
+                if asset.attribute_name in profile:
+                    rates.append((asset.asset_id, profile[asset.attribute_name], True))
+            else:
+                rates += [(asset.asset_id, rate, True) for rate in profile.values()]
+    return rates
+
+
+def count_pairs(rates, grouping, prune_symmetric_pairs=False) -> int:
+    """Pairs correlated for a ChildrenGrouping, given the series_rates() of a request."""
+    grouping = ChildrenGrouping(grouping)
+    if grouping == ChildrenGrouping.reference:
+        return max(len(rates) - 1, 0)
+    if grouping == ChildrenGrouping.within_group:
+        group_sizes = Counter(asset_id for asset_id, _, _ in rates).values()
+    else:
+        group_sizes = [len(rates)]
+    if prune_symmetric_pairs:
+        return sum(size * (size + 1) // 2 for size in group_sizes)
+    return sum(size**2 for size in group_sizes)
+
+
+def count_lag_steps(lags, lag_stride: int = 1) -> int:
+    """
+    Lag steps evaluated per pair; a coarse search also refines around its best step.
+    Steps of different units with the same absolute offset are evaluated once.
+    """
+    if not lags:
+        return 1
+    offsets = {
+        lag_offset_key(lag_unit, step)
+        for lag_dict in lags
+        for lag_unit, lag_value in lag_dict.items()
+        for step in range(-lag_value, lag_value + 1)
+    }
+    if lag_stride <= 1:
+        return len(offsets)
+    steps = 0
+    for lag_dict in lags:
+        for lag_value in lag_dict.values():
+            full = 2 * lag_value + 1
+            steps += min(full, math.ceil(full / lag_stride) + 1 + 2 * lag_stride)
+    return min(steps, len(offsets))
+
+
+def requested_seconds(request: CorrelationRequest) -> float:
+    if request.start_time is None:
+        return 0
+    # Normalized like get_data, so naive and aware times can be mixed
+    timezone = pytz.timezone("Europe/Berlin")
+    start_time = request.start_time.astimezone(timezone)
+    end_time = (
+        request.end_time.astimezone(timezone)
+        if request.end_time
+        else datetime.now(timezone)
+    )
+    return max((end_time - start_time).total_seconds(), 0)
+
+
+def estimate_cost(
+    request: CorrelationRequest, plan=None, grouping=ChildrenGrouping.all
+):
+    """
+    Predicts the work units and peak memory of a request from the number of series,
+    their expected sample counts over the requested time range, the pairs selected by
+    'grouping' and the lag spec, optionally for a degraded execution plan. Approximate
+    requests are estimated at their initial sample size (APPROXIMATE_SAMPLE_SIZE).
+    """
+    plan = plan or {}
+    seconds = requested_seconds(request)
+    rates = series_rates(request)
+    samples = [rate * seconds for _, rate, _ in rates]
+    if plan.get("resample_seconds"):
+        samples = [min(s, seconds / plan["resample_seconds"]) for s in samples]
+
+    series = len(samples)
+    pairs = count_pairs(rates, grouping, plan.get("prune_symmetric_pairs"))
+    lag_steps = count_lag_steps(request.lags, plan.get("lag_stride", 1))
+    samples_per_series = sum(samples) / series if series else 0
+    aligned_samples = samples_per_series
+    if request.approximate:
+        aligned_samples = min(samples_per_series, approximate_sample_size)
+    return {
+        "series": series,
+        "series_with_known_frequency": sum(known for _, _, known in rates),
+        "samples_per_series": int(samples_per_series),
+        "pairs": pairs,
+        "lag_steps": lag_steps,
+        "work_units": int(pairs * lag_steps * aligned_samples),
+        "memory_bytes": int(sum(samples) * bytes_per_sample),
+        "max_work_units": int(max_work_units),
+        "max_memory_bytes": int(max_memory_bytes),
+    }
+
+
+def within_budget(estimate) -> bool:
+    return (
+        estimate["work_units"] <= max_work_units
+        and estimate["memory_bytes"] <= max_memory_bytes
+    )
+
+
+def plan_request(
+    request: CorrelationRequest, action: str = None, grouping=ChildrenGrouping.all
+):
+    """
+    Estimates a request before any data is fetched and decides how to run it. Requests
+    within the budgets run as is. Otherwise, depending on 'action' (default:
+    CORRELATION_OVER_BUDGET_ACTION) they are rejected, queued for a heavy-request slot,
+    or degraded step by step: symmetric pairs are computed once, lags are searched
+    coarsely and refined around the best coarse step, and finally the series are
+    resampled to a coarser grid.
+
+    'grouping' (see ChildrenGrouping) restricts the estimated pairs.
+
+    Returns (estimate, plan); raises CostBudgetExceeded if the request can't be run.
+    """
+    action = action or over_budget_action
+    plan = {
+        "action": "run",
+        "prune_symmetric_pairs": False,
+        "lag_stride": 1,
+        "resample_seconds": None,
+    }
+    estimate = estimate_cost(request, grouping=grouping)
+    if within_budget(estimate):
+        return estimate, plan
+
+    if action == "reject":
+        raise CostBudgetExceeded("The request exceeds the cost budget.", estimate)
+    if action == "queue":
+        plan["action"] = "queued"
+        return estimate, plan
+
+    plan["action"] = "degraded"
+    plan["prune_symmetric_pairs"] = True
+    degraded = estimate_cost(request, plan, grouping)
+
+    max_lag = max(
+        (value for lag_dict in request.lags or [] for value in lag_dict.values()),
+        default=0,
+    )
+    # Coarser strides need fewer coarse steps but a wider refinement, stop once the
+    # number of evaluated steps no longer drops
+    lag_stride = 2
+    while not within_budget(degraded) and lag_stride <= max_lag:
+        candidate = estimate_cost(request, {**plan, "lag_stride": lag_stride}, grouping)
+        if candidate["lag_steps"] >= degraded["lag_steps"]:
+            break
+        plan["lag_stride"] = lag_stride
+        degraded = candidate
+        lag_stride *= 2
+
+    if not within_budget(degraded) and degraded["samples_per_series"] > 0:
+        factor = max(
+            degraded["work_units"] / max_work_units,
+            degraded["memory_bytes"] / max_memory_bytes,
+        )
+        target_samples = degraded["samples_per_series"] / factor
+        if target_samples >= min_resampled_samples:
+            plan["resample_seconds"] = math.ceil(
+                requested_seconds(request) / target_samples
+            )
+            degraded = estimate_cost(request, plan, grouping)
+
+    if not within_budget(degraded):
+        raise CostBudgetExceeded(
+            "The request exceeds the cost budget even in degraded mode.", estimate
+        )
+    logger.info(f"Degrading request with estimate {estimate} to {plan}")
+    return {**estimate, "degraded": degraded}, plan
+
+
+@contextmanager
+def admission_slot(plan):
+    """Holds one of the CORRELATION_HEAVY_CONCURRENCY slots for queued requests."""
+    if plan["action"] != "queued":
+        yield
+        return
+    if not heavy_slots.acquire(timeout=queue_timeout_seconds):
+        raise AdmissionTimeout("Timed out waiting for a slot for heavy requests.")
+    try:
+        yield
+    finally:
+        heavy_slots.release()
@@ -1,37 +1,87 @@
+import numpy as np
 import pandas as pd
+from array import array
 from datetime import timedelta
-import eliona.api_client2
-from eliona.api_client2.rest import ApiException
-from eliona.api_client2.api.data_api import DataApi
-from eliona.api_client2.api.assets_api import AssetsApi
+from functools import lru_cache
 import os
 import logging
 
 from api.models import AssetAttribute
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, fall back to the standard library
+    from json import loads as json_loads
+
 # Initialize the logger
 logger = logging.getLogger(__name__)
-# Set up configuration for the Eliona API
-configuration = eliona.api_client2.Configuration(host=os.getenv("API_ENDPOINT"))
-configuration.api_key["ApiKeyAuth"] = os.getenv("API_TOKEN")
 
-# Create an instance of the API client
-api_client = eliona.api_client2.ApiClient(configuration)
-data_api = DataApi(api_client)
-assets_api = AssetsApi(api_client)
+# Parse get_data_trends responses from the raw JSON body instead of typed models
+use_raw_json = os.getenv("TREND_DATA_RAW_JSON", "true").lower() in ("1", "true", "yes")
+
+
+# The Eliona client is imported and configured on first use, keeping it out of startup
+@lru_cache(maxsize=None)
+def get_api_client():
+    import eliona.api_client2
+
+    # Set up configuration for the Eliona API
+    configuration = eliona.api_client2.Configuration(host=os.getenv("API_ENDPOINT"))
+    configuration.api_key["ApiKeyAuth"] = os.getenv("API_TOKEN")
+    return eliona.api_client2.ApiClient(configuration)
+
+
+@lru_cache(maxsize=None)
+def get_data_api():
+    from eliona.api_client2.api.data_api import DataApi
+
+    return DataApi(get_api_client())
+
 
+@lru_cache(maxsize=None)
+def get_assets_api():
+    from eliona.api_client2.api.assets_api import AssetsApi
+
+    return AssetsApi(get_api_client())
+
+
+def child_depth(asset, asset_id):
+    """Levels between an asset and its locational ancestor asset_id, None if unrelated."""
+    path = [i for i in asset.locational_asset_id_path or [] if i != asset.id]
+    if asset_id not in path:
+        return None
+    return len(path) - path.index(asset_id)
+
+
+def get_all_asset_children(asset_id, asset_types=None, max_depth=None):
+    """
+    Returns the asset and its locational descendants as AssetAttribute objects,
+    optionally only those of the given asset types (the asset itself included) and
+    up to max_depth levels below the asset.
+    """
+    from eliona.api_client2.rest import ApiException
 
-def get_all_asset_children(asset_id):
     try:
         logger.info(f"Fetching all assets to find children for asset {asset_id}")
-        assets = assets_api.get_assets()
-        child_ids = [asset_id]  # Start with the parent asset_id
+        assets = get_assets_api().get_assets()
+        parent_type = next(
+            (asset.asset_type for asset in assets if asset.id == asset_id), None
+        )
+        # Start with the parent asset_id, unless its type is filtered out
+        if asset_types and parent_type not in asset_types:
+            child_ids = []
+        else:
+            child_ids = [asset_id]
 
         for asset in assets:
-            if asset_id in asset.locational_asset_id_path:
-                child_ids.append(asset.id)
+            depth = child_depth(asset, asset_id)
+            if depth is None or (max_depth is not None and depth > max_depth):
+                continue
+            if asset_types and asset.asset_type not in asset_types:
+                continue
+            child_ids.append(asset.id)
 
-        logger.info(f"Found {len(child_ids) - 1} children for asset {asset_id}")
+        logger.info(f"Found {len(child_ids)} assets for asset {asset_id}")
         return [AssetAttribute(asset_id=child_id) for child_id in child_ids]
     except ApiException as e:
         logger.error(f"Exception when calling AssetsApi->get_assets: {e}")
@@ -39,12 +89,14 @@ def get_all_asset_children(asset_id):
 
 
 def get_trend_data(asset_id, start_date, end_date):
+    from eliona.api_client2.rest import ApiException
+
     asset_id = int(asset_id)
     from_date = start_date.isoformat()
     to_date = end_date.isoformat()
     try:
         logger.info(f"Fetching data for asset {asset_id} from {from_date} to {to_date}")
-        result = data_api.get_data_trends(
+        result = get_data_api().get_data_trends(
             from_date=from_date,
             to_date=to_date,
             asset_id=asset_id,
@@ -57,63 +109,156 @@ def get_trend_data(asset_id, start_date, end_date):
         return None
 
 
+def get_trend_data_raw(asset_id, start_date, end_date):
+    """
+    Fast path for get_trend_data: requests the response body without preloading the
+    client models and parses it with orjson (if installed) into a
+    (timestamps, data dicts) chunk. Raises on any error so the caller can fall back.
+    """
+    response = get_data_api().get_data_trends_without_preload_content(
+        from_date=start_date.isoformat(),
+        to_date=end_date.isoformat(),
+        asset_id=int(asset_id),
+        data_subtype="input",
+    )
+    try:
+        if response.status != 200:
+            raise ValueError(f"Unexpected status {response.status}")
+        records = json_loads(response.data)
+    finally:
+        response.release_conn()
+
+    timestamps = [record["timestamp"] for record in records]
+    data = [record.get("data") or {} for record in records]
+    logger.info(f"Received {len(timestamps)} data points (raw JSON)")
+    return timestamps, data
+
+
+def fetch_trend_chunk(asset_id, start_date, end_date):
+    """
+    Fetches one chunk as (timestamps, data dicts). Uses the raw-JSON fast path and
+    falls back to the typed client if it fails.
+    """
+    if use_raw_json:
+        try:
+            return get_trend_data_raw(asset_id, start_date, end_date)
+        except Exception as e:
+            logger.warning(
+                f"Raw JSON fetch failed for asset {asset_id}, using typed client: {e}"
+            )
+
+    result = get_trend_data(asset_id, start_date, end_date)
+    if not result:
+        return [], []
+    return [entry.timestamp for entry in result], [entry.data for entry in result]
+
+
 def fetch_data_in_chunks(asset_id, start_date, end_date):
-    all_data = []
+    """
+    Yields the trend data of an asset one API chunk (5 days) at a time, so callers can
+    convert and discard each chunk before the next one is fetched.
+    """
     current_start = start_date
     while current_start < end_date:
         current_end = min(current_start + timedelta(days=5), end_date)
-        data_chunk = get_trend_data(asset_id, current_start, current_end)
-        if data_chunk:
-            all_data.extend(data_chunk)
+        data_chunk = fetch_trend_chunk(asset_id, current_start, current_end)
+        if data_chunk[0]:
+            yield data_chunk
+        del data_chunk  # Don't hold the chunk while fetching the next one
         current_start = current_end + timedelta(seconds=1)
-    return all_data
 
 
-def convert_to_pandas(data):
-    # Dictionary to hold the rows, using the timestamp as the key
-    formatted_data = {}
-
-    for entry in data:
-        # Extract timestamp and data
-        timestamp = entry.timestamp
-        data_dict = entry.data
+def to_float(value):
+    """Converts an attribute value to float, non-numeric values become NaN."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
 
-        # If this timestamp already exists, update the existing row
-        if timestamp in formatted_data:
-            formatted_data[timestamp].update(data_dict)
-        else:
-            # Create a new row for this timestamp
-            formatted_data[timestamp] = data_dict
 
-    # Convert the dictionary to a pandas DataFrame
-    df = pd.DataFrame.from_dict(formatted_data, orient="index")
+def chunk_to_arrays(chunk, attributes=None):
+    """
+    Converts one (timestamps, data dicts) chunk into {attribute: (timestamps, values)}
+    NumPy arrays, with timestamps as int64 nanoseconds (UTC). Non-numeric values are
+    dropped, and so are attributes not in 'attributes' (a set, None keeps all).
+    """
+    chunk_timestamps, chunk_data = chunk
+    timestamps = (
+        pd.to_datetime(chunk_timestamps, utc=True, format="ISO8601").as_unit("ns").asi8
+    )
+    positions = {}
+    values = {}
+    for position, data in enumerate(chunk_data):
+        # The typed client returns None for entries without data
+        for attribute, value in (data or {}).items():
+            if attributes is not None and attribute not in attributes:
+                continue
+            value = to_float(value)
+            if np.isnan(value):
+                continue
+            positions.setdefault(attribute, []).append(position)
+            values.setdefault(attribute, []).append(value)
 
-    # Set the index (timestamp) as a proper datetime index
-    df.index = pd.to_datetime(df.index, utc=True)
+    return {
+        attribute: (
+            timestamps[np.asarray(positions[attribute], dtype=np.intp)],
+            np.asarray(values[attribute], dtype=float),
+        )
+        for attribute in values
+    }
 
-    # Convert the index to the desired timezone (e.g., Europe/Berlin)
-    df.index = df.index.tz_convert("Europe/Berlin")
 
-    # **Optional: Sort the DataFrame by index (timestamp)**
-    df.sort_index(inplace=True)
+def convert_to_pandas(chunks, attributes=None):
+    """
+    Builds one pandas Series per attribute (indexed by timestamp, Europe/Berlin) from an
+    iterable of API chunks, only of the given 'attributes' if not None. Each chunk is
+    appended to growing per-attribute int64/float64 buffers and then discarded, so peak
+    memory stays close to the final numeric arrays.
+    For duplicate timestamps the last received value wins.
+    """
+    buffers = {}
+    for chunk in chunks:
+        for attribute, (timestamps, values) in chunk_to_arrays(
+            chunk, attributes
+        ).items():
+            timestamp_buffer, value_buffer = buffers.setdefault(
+                attribute, (array("q"), array("d"))
+            )
+            timestamp_buffer.frombytes(timestamps.tobytes())
+            value_buffer.frombytes(values.tobytes())
+        del chunk
 
-    # Reset index to have 'timestamp' as a column
-    df.reset_index(inplace=True)
-    df.rename(columns={"index": "timestamp"}, inplace=True)
+    series = {}
+    for attribute in list(buffers):
+        timestamp_buffer, value_buffer = buffers.pop(attribute)
+        index = pd.DatetimeIndex(
+            np.frombuffer(timestamp_buffer, dtype=np.int64), tz="UTC", name="timestamp"
+        ).tz_convert("Europe/Berlin")
+        values = pd.Series(
+            np.frombuffer(value_buffer, dtype=float).copy(), index=index, name=attribute
+        )
+        values = values[~values.index.duplicated(keep="last")]
+        if not values.index.is_monotonic_increasing:
+            values.sort_index(inplace=True)
+        series[attribute] = values
 
-    return df
+    return series
 
 
 def fetch_pandas_data(
     asset_id,
     start_date,
     end_date,
+    attributes=None,
 ):
-    # Fetch all data without filtering by attributes
+    """
+    Fetches the attributes of an asset as {attribute: pd.Series}, streaming the API
+    chunks straight into per-attribute arrays. The trend API returns all attributes
+    of the asset; with 'attributes' (a collection of names) only those are converted
+    and kept.
+    """
     print(f"Fetching data for asset {asset_id} from {start_date} to {end_date}")
-    data = fetch_data_in_chunks(asset_id, start_date, end_date)
-
-    # Convert data to pandas DataFrame
-    df = convert_to_pandas(data)
-
-    return df
+    chunks = fetch_data_in_chunks(asset_id, start_date, end_date)
+    return convert_to_pandas(
+        chunks, None if attributes is None else frozenset(attributes)
+    )
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 from enum import Enum
 from datetime import datetime
@@ -13,6 +13,18 @@ class LagUnit(str, Enum):
     years = "years"
 
 
+class CorrelationMethod(str, Enum):
+    pearson = "pearson"
+    spearman = "spearman"
+    kendall = "kendall"
+
+
+class ChildrenGrouping(str, Enum):
+    all = "all"  # every pair of series
+    within_group = "within_group"  # only attributes of the same asset
+    reference = "reference"  # one reference attribute against all others
+
+
 class AssetAttribute(BaseModel):
     asset_id: int
     attribute_name: Optional[str] = None
@@ -24,6 +36,12 @@ class CorrelationRequest(BaseModel):
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
     to_email: Optional[str] = None
+    method: CorrelationMethod = CorrelationMethod.pearson
+    include_lag_details: bool = False  # opt-in, see api.responses
+    include_report_html: bool = False
+    approximate: bool = False  # estimate from samples, see api.correlation_sampling
+    approximate_threshold: float = Field(0.5, ge=0, le=1)
+    confidence_level: float = Field(0.95, gt=0, lt=1)
 
 
 class CorrelateChildrenRequest(BaseModel):
@@ -32,6 +50,39 @@ class CorrelateChildrenRequest(BaseModel):
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
     to_email: Optional[str] = None
+    method: CorrelationMethod = CorrelationMethod.pearson
+    include_lag_details: bool = False  # opt-in, see api.responses
+    include_report_html: bool = False
+    attribute_names: Optional[List[str]] = None
+    asset_types: Optional[List[str]] = None
+    max_depth: Optional[int] = Field(None, ge=1)
+    grouping: ChildrenGrouping = ChildrenGrouping.all
+    reference: Optional[AssetAttribute] = None
+    approximate: bool = False
+    approximate_threshold: float = Field(0.5, ge=0, le=1)
+    confidence_level: float = Field(0.95, gt=0, lt=1)
+
+
+class RollingCorrelationRequest(BaseModel):
+    assets: List[AssetAttribute]
+    window: Dict[LagUnit, int]
+    lag: Optional[Dict[LagUnit, int]] = None
+    max_points: Optional[int] = Field(1000, ge=1)
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+
+
+class PrecomputeGroup(BaseModel):
+    name: str
+    asset_id: Optional[int] = None  # correlate the children of this asset ...
+    assets: Optional[List[AssetAttribute]] = None  # ... or these assets
+    lags: Optional[List[Dict[LagUnit, int]]] = None
+    method: CorrelationMethod = CorrelationMethod.pearson
+    window: Dict[
+        LagUnit, int
+    ]  # time window ending at the computation, e.g. {"days": 7}
+    refresh_hour: int = Field(3, ge=0, le=23)  # daily recomputation, Europe/Berlin time
+    max_age_hours: float = 24.0
 
 
 class CorrelationResult(BaseModel):
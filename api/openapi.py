@@ -1,20 +1,66 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.middleware.gzip import GZipMiddleware
+from typing import Optional
 
 from datetime import datetime
-import pytz
+import json
+import os
 import yaml
-from api.models import CorrelationRequest, CorrelateChildrenRequest
-from api.correlation import get_data, compute_correlation
-from api.plot_correlation import (
-    create_best_correlation_heatmap,
-    in_depth_plot_scatter,
-    plot_lag_correlations,
+from api import startup
+from api.models import (
+    AssetAttribute,
+    ChildrenGrouping,
+    CorrelationRequest,
+    CorrelateChildrenRequest,
+    PrecomputeGroup,
+    RollingCorrelationRequest,
 )
+from api.correlation import (
+    get_data,
+    compute_correlation,
+    compute_rolling_correlation,
+    select_pairs,
+)
+from api.series_store import is_mapped, release_series
+from api.correlation_cache import correlation_cache
+from api.precompute import precompute_store
+from api.cost import (
+    AdmissionTimeout,
+    CostBudgetExceeded,
+    admission_slot,
+    plan_request,
+)
+from api.single_flight import correlation_flights, correlation_request_key
+from api.responses import correlation_response
 from api.get_trend_data import get_all_asset_children
-from api.pdf_template import create_pdf
+from api.profiling import (
+    ProfiledRoute,
+    ProfilingMiddleware,
+    profile_path,
+    valid_token,
+)
 from fastapi.responses import FileResponse
 from api.sendEmail import send_evaluation_report_as_mail
 
+# The plotting (matplotlib/seaborn) and PDF (WeasyPrint) stacks are imported inside
+# the endpoints that need them, so they are only loaded on first use.
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.mark_ready()
+    precompute_store.start()
+    if os.getenv("PDF_RENDERER_WARMUP", "true").lower() in ("1", "true", "yes"):
+        # Sets up WeasyPrint on the renderer thread, so the first report is fast
+        from api.pdf_template import pdf_renderer
+
+        pdf_renderer.start(warm_up=True)
+    yield
+    precompute_store.stop()
+
+
 # Create the FastAPI app instance
 app = FastAPI(
     title="Correlation App API",
@@ -22,7 +68,19 @@ app = FastAPI(
     version="1.0.0",
     openapi_url="/v1/version/openapi.json",
     openapi_version="3.1.0",
+    lifespan=lifespan,
 )
+# Endpoints can be profiled per request with the X-Profile-Token header
+app.router.route_class = ProfiledRoute
+
+# Compress responses for clients that accept it: brotli if available, gzip otherwise
+try:
+    from brotli_asgi import BrotliMiddleware
+
+    app.add_middleware(BrotliMiddleware, minimum_size=1024, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(ProfilingMiddleware)
 
 # Load custom OpenAPI schema
 with open("openapi.yaml", "r") as f:
@@ -38,101 +96,285 @@ app.openapi = custom_openapi
 
 
 # Define endpoints
-@app.post("/v1/correlate")
-def correlate_assets(request: CorrelationRequest):
-    end_time = request.end_time or datetime.now()
-    dataframes = get_data(request)
-    correlations = compute_correlation(dataframes, request)
-    create_best_correlation_heatmap(correlations)
+@app.get("/v1/ready")
+def ready():
+    """
+    Readiness probe. Reports the measured startup time against its budget and the
+    state of the background app registration, with status 503 until the app is ready.
+    """
+    return JSONResponse(
+        status_code=200 if startup.status["ready"] else 503, content=startup.status
+    )
 
-    include_heatmap: bool = True
-    include_scatter: bool = False
-    include_lag_plots: bool = False
-    include_details: bool = True
 
-    pdf_file_path = "/tmp/correlation_report.pdf"
-    create_pdf(
-        request.start_time,
-        request.end_time,
-        pdf_file_path,
-        correlations,
-        include_heatmap,
-        include_scatter,
-        include_lag_plots,
-        include_details,
+def run_correlation(
+    request: CorrelationRequest,
+    include_report: bool = True,
+    grouping: ChildrenGrouping = ChildrenGrouping.all,
+    reference: Optional[AssetAttribute] = None,
+):
+    """
+    Computes the correlations of a request, or takes them from a matching precomputed
+    group (see api.precompute). The heatmap/PDF report is only rendered if it is
+    embedded in the response or sent by email. 'grouping' and 'reference' restrict the
+    correlated pairs (see select_pairs).
+
+    Identical requests in flight at the same time share one computation (see
+    api.single_flight); the report is then mailed to each requester.
+    """
+    render_report = include_report or bool(request.to_email)
+    response = correlation_flights.do(
+        correlation_request_key(
+            request,
+            "correlate",
+            render_report,
+            ChildrenGrouping(grouping).value,
+            (reference.asset_id, reference.attribute_name) if reference else None,
+        ),
+        compute_correlation_response,
+        request,
+        render_report,
+        grouping,
+        reference,
     )
-    html_file_path = "/tmp/report.html"
-    with open(html_file_path, "r", encoding="utf-8") as html_file:
-        html_content = html_file.read()
     if request.to_email:
-        send_evaluation_report_as_mail(pdf_file_path, request.to_email)
-    return {
+        send_evaluation_report_as_mail(response["pdf_file_path"], request.to_email)
+    response = dict(response)
+    response.pop("pdf_file_path")
+    if not include_report:
+        response["report_html"] = None
+    return response
+
+
+def compute_correlation_response(
+    request: CorrelationRequest,
+    render_report: bool,
+    grouping: ChildrenGrouping = ChildrenGrouping.all,
+    reference: Optional[AssetAttribute] = None,
+):
+    end_time = request.end_time or datetime.now()
+    precomputed = None
+    if grouping == ChildrenGrouping.all:
+        precomputed = precompute_store.lookup(request)
+    if precomputed is not None:
+        correlations = precomputed["correlation"]
+    else:
+        cost_estimate, plan = admit_request(request, grouping)
+        with admitted(plan):
+            dataframes = get_data(request, resample_seconds=plan["resample_seconds"])
+            try:
+                correlations = compute_correlation(
+                    dataframes,
+                    request,
+                    lag_stride=plan["lag_stride"],
+                    prune_symmetric_pairs=plan["prune_symmetric_pairs"],
+                    pairs=select_pairs(dataframes, grouping, reference),
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            finally:
+                release_series(dataframes)
+
+    html_content = None
+    pdf_file_path = None
+    if render_report:
+        from api.plot_correlation import create_best_correlation_heatmap
+        from api.pdf_template import create_pdf
+
+        create_best_correlation_heatmap(correlations)
+
+        include_heatmap: bool = True
+        include_scatter: bool = False
+        include_lag_plots: bool = False
+        include_details: bool = True
+
+        pdf_file_path = "/tmp/correlation_report.pdf"
+        create_pdf(
+            request.start_time,
+            request.end_time,
+            pdf_file_path,
+            correlations,
+            include_heatmap,
+            include_scatter,
+            include_lag_plots,
+            include_details,
+        )
+        html_file_path = "/tmp/report.html"
+        with open(html_file_path, "r", encoding="utf-8") as html_file:
+            html_content = html_file.read()
+    response = {
         "assets": request.assets,
         "lags": request.lags,
         "start_time": request.start_time,
         "end_time": end_time,
         "correlation": correlations,
         "report_html": html_content,
+        "pdf_file_path": pdf_file_path,
     }
+    if precomputed is not None:
+        response["precomputed"] = {
+            "group": precomputed["group"],
+            "computed_at": precomputed["computed_at"],
+            "start_time": precomputed["start_time"],
+            "end_time": precomputed["end_time"],
+        }
+    else:
+        response["cost_estimate"] = {**cost_estimate, "plan": plan}
+    return response
+
+
+def admit_request(
+    request: CorrelationRequest, grouping: ChildrenGrouping = ChildrenGrouping.all
+):
+    """
+    Estimates the cost of a request before any data is fetched (see api.cost) and
+    returns (estimate, plan), or rejects it with 413.
+    """
+    try:
+        return plan_request(request, grouping=grouping)
+    except CostBudgetExceeded as e:
+        raise HTTPException(
+            status_code=413, detail={"message": str(e), "cost_estimate": e.estimate}
+        )
+
+
+@contextmanager
+def admitted(plan):
+    """Runs a queued request once a heavy-request slot is free, 503 on timeout."""
+    try:
+        with admission_slot(plan):
+            yield
+    except AdmissionTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.post("/v1/correlate")
+def correlate_assets(request: CorrelationRequest, accept: Optional[str] = Header(None)):
+    response = run_correlation(request, request.include_report_html)
+    return correlation_response(
+        response, accept, request.include_lag_details, request.include_report_html
+    )
 
 
 @app.post("/v1/correlate-children")
-def correlate_asset_children(request: CorrelateChildrenRequest):
-    child_asset_ids = get_all_asset_children(request.asset_id)
+def correlate_asset_children(
+    request: CorrelateChildrenRequest, accept: Optional[str] = Header(None)
+):
+    """
+    Correlates the attributes of an asset and its descendants, optionally only the
+    given attribute_names of the assets of the given asset_types up to max_depth
+    levels below the asset. 'grouping' limits the pairs to the attributes of each
+    asset (within_group) or to the 'reference' attribute against all others
+    (reference); each asset is fetched once and only the listed attributes kept.
+    """
+    if request.grouping == ChildrenGrouping.reference and (
+        request.reference is None or not request.reference.attribute_name
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="The reference grouping needs a reference with an attribute_name.",
+        )
+    child_asset_ids = get_all_asset_children(
+        request.asset_id, request.asset_types, request.max_depth
+    )
     print(f"Found {len(child_asset_ids)} children for asset {request.asset_id}")
+    assets = child_asset_ids
+    if request.attribute_names:
+        assets = [
+            AssetAttribute(asset_id=child.asset_id, attribute_name=attribute_name)
+            for child in child_asset_ids
+            for attribute_name in request.attribute_names
+        ]
+    if request.grouping == ChildrenGrouping.reference and not any(
+        asset.asset_id == request.reference.asset_id
+        and asset.attribute_name in (None, request.reference.attribute_name)
+        for asset in assets
+    ):
+        assets = [request.reference] + assets
+
     correlation_request = CorrelationRequest(
-        assets=child_asset_ids,
+        assets=assets,
         lags=request.lags,
         start_time=request.start_time,
         end_time=request.end_time,
         to_email=request.to_email,
+        method=request.method,
+        approximate=request.approximate,
+        approximate_threshold=request.approximate_threshold,
+        confidence_level=request.confidence_level,
     )
 
-    response = correlate_assets(correlation_request)
+    response = run_correlation(
+        correlation_request,
+        request.include_report_html,
+        request.grouping,
+        request.reference,
+    )
     correlations = response["correlation"]
     html_content = response["report_html"]
 
-    return {
-        "assets": child_asset_ids,
+    children_response = {
+        "assets": assets,
         "lags": request.lags,
         "start_time": request.start_time,
         "end_time": request.end_time,
         "correlation": correlations,
         "report_html": html_content,
     }
+    for key in ("precomputed", "cost_estimate"):
+        if key in response:
+            children_response[key] = response[key]
+    return correlation_response(
+        children_response,
+        accept,
+        request.include_lag_details,
+        request.include_report_html,
+    )
 
 
-@app.post("/v1/in-depth-correlation")
-def in_depth_correlation(request: CorrelationRequest):
+def build_in_depth_report(request: CorrelationRequest):
     """
-    1) Fetch data for exactly two assets/attributes.
-    2) Compute correlation (including lags).
-    3) Plot the lag correlation lines.
-    4) Create and return a scatter plot in Base64 form.
+    Fetches exactly two assets/attributes, computes their correlation (including lags),
+    plots the lag correlations and the scatter plot and renders the PDF/HTML report.
     """
-    if len(request.assets) != 2:
-        raise HTTPException(status_code=400, detail="Exactly two assets are required.")
+    from api.plot_correlation import in_depth_plot_scatter, plot_lag_correlations
+    from api.pdf_template import create_pdf
 
-    # 1) Fetch data
-    df_infos = get_data(request)
-    if len(df_infos) != 2:
-        raise HTTPException(
-            status_code=400,
-            detail="Could not retrieve data for both assets/attributes. Check logs.",
-        )
+    cost_estimate, plan = admit_request(request)
+    with admitted(plan):
+        # 1) Fetch data
+        df_infos = get_data(request, resample_seconds=plan["resample_seconds"])
+        try:
+            if len(df_infos) != 2:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Could not retrieve data for both assets/attributes. Check logs.",
+                )
 
-    correlations = compute_correlation(df_infos, request)
+            # Each pair is aligned once, the plots reuse the matched samples
+            correlations, aligned_pairs = compute_correlation(
+                df_infos,
+                request,
+                lag_stride=plan["lag_stride"],
+                prune_symmetric_pairs=plan["prune_symmetric_pairs"],
+                return_aligned=True,
+            )
 
-    lag_plot_filenames = plot_lag_correlations(
-        correlations, output_dir="/tmp/lag_plots"
-    )
+            lag_plot_filenames = plot_lag_correlations(
+                correlations, output_dir="/tmp/lag_plots", aligned_pairs=aligned_pairs
+            )
 
-    try:
-        scatter_result = in_depth_plot_scatter(
-            df_infos, output_file="/tmp/in_depth_scatter.png"
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+            pair_name = f"{df_infos[0].name} and {df_infos[1].name}"
+            if pair_name not in aligned_pairs:
+                raise ValueError("The two assets/attributes must differ.")
+            scatter_result = in_depth_plot_scatter(
+                aligned_pairs[pair_name]["zero_lag"],
+                output_file="/tmp/in_depth_scatter.png",
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            release_series(df_infos)
     include_heatmap: bool = False
     include_scatter: bool = True
     include_lag_plots: bool = True
@@ -154,68 +396,197 @@ def in_depth_correlation(request: CorrelationRequest):
     with open(html_file_path, "r", encoding="utf-8") as html_file:
         html_content = html_file.read()
 
-    if request.to_email:
-        send_evaluation_report_as_mail(pdf_file_path, request.to_email)
     return {
-        "assets": request.assets,
-        "lags": request.lags,
-        "start_time": request.start_time,
-        "end_time": request.end_time,
         "correlation": correlations,
         "scatter_result_columns": scatter_result["columns"],
         "report_html": html_content,
+        "pdf_file_path": pdf_file_path,
+        "cost_estimate": {**cost_estimate, "plan": plan},
     }
 
 
-@app.post("/v1/generate-report")
-def generate_report(request: CorrelationRequest):
+def run_in_depth_report(request: CorrelationRequest):
     """
-    Generate a PDF report for the correlation analysis.
+    Builds the in-depth report, sharing the work with identical requests in flight,
+    and mails it if requested.
     """
-    include_heatmap: bool = False
-    include_scatter: bool = True
-    include_lag_plots: bool = True
-    include_details: bool = True
     if len(request.assets) != 2:
         raise HTTPException(status_code=400, detail="Exactly two assets are required.")
 
-    # 1) Fetch data
-    df_infos = get_data(request)
-    if len(df_infos) != 2:
+    report = correlation_flights.do(
+        correlation_request_key(request, "in-depth"), build_in_depth_report, request
+    )
+    if request.to_email:
+        send_evaluation_report_as_mail(report["pdf_file_path"], request.to_email)
+    return report
+
+
+@app.post("/v1/in-depth-correlation")
+def in_depth_correlation(
+    request: CorrelationRequest, accept: Optional[str] = Header(None)
+):
+    """
+    1) Fetch data for exactly two assets/attributes.
+    2) Compute correlation (including lags).
+    3) Plot the lag correlation lines.
+    4) Create and return a scatter plot in Base64 form.
+    """
+    report = run_in_depth_report(request)
+    return correlation_response(
+        {
+            "assets": request.assets,
+            "lags": request.lags,
+            "start_time": request.start_time,
+            "end_time": request.end_time,
+            "correlation": report["correlation"],
+            "scatter_result_columns": report["scatter_result_columns"],
+            "report_html": report["report_html"],
+            "cost_estimate": report["cost_estimate"],
+        },
+        accept,
+        request.include_lag_details,
+        request.include_report_html,
+    )
+
+
+@app.post("/v1/rolling-correlation")
+def rolling_correlation(request: RollingCorrelationRequest):
+    """
+    Computes how the correlation between exactly two attributes evolves over time,
+    using a rolling time window and an optional fixed lag.
+    """
+    if len(request.assets) != 2:
+        raise HTTPException(status_code=400, detail="Exactly two assets are required.")
+    if len(request.window) != 1 or next(iter(request.window.values())) <= 0:
         raise HTTPException(
-            status_code=400,
-            detail="Could not retrieve data for both assets/attributes. Check logs.",
+            status_code=400, detail="Window must be a single positive {unit: value}."
+        )
+    if request.lag is not None and len(request.lag) != 1:
+        raise HTTPException(
+            status_code=400, detail="Lag must be a single {unit: value}."
         )
 
-    correlations = compute_correlation(df_infos, request)
+    correlation_request = CorrelationRequest(
+        assets=request.assets,
+        start_time=request.start_time,
+        end_time=request.end_time,
+    )
+    df_infos = get_data(correlation_request)
+    try:
+        if len(df_infos) != 2:
+            raise HTTPException(
+                status_code=400,
+                detail="Could not retrieve data for both assets/attributes. Check logs.",
+            )
+        if any(is_mapped(df_info) for df_info in df_infos):
+            raise HTTPException(
+                status_code=400,
+                detail="The requested data exceeds the memory budget for rolling correlations. Use a shorter time range.",
+            )
 
-    lag_plot_filenames = plot_lag_correlations(
-        correlations, output_dir="/tmp/lag_plots"
+        rolling = compute_rolling_correlation(
+            df_infos[0],
+            df_infos[1],
+            request.window,
+            lag=request.lag,
+            max_points=request.max_points,
+        )
+    finally:
+        release_series(df_infos)
+    return {
+        "assets": request.assets,
+        "window": request.window,
+        "lag": request.lag,
+        "start_time": request.start_time,
+        "end_time": request.end_time,
+        "rolling_correlation": rolling,
+    }
+
+
+@app.post("/v1/generate-report")
+def generate_report(request: CorrelationRequest):
+    """
+    Generate a PDF report for the correlation analysis.
+    """
+    report = run_in_depth_report(request)
+    return FileResponse(
+        report["pdf_file_path"],
+        media_type="application/pdf",
+        filename="correlation_report.pdf",
     )
 
+
+@app.get("/v1/cache")
+def get_cache_stats():
+    """
+    Returns size and hit statistics of the per-pair correlation result cache.
+    """
+    return correlation_cache.stats()
+
+
+@app.delete("/v1/cache")
+def invalidate_cache(asset_id: Optional[int] = None):
+    """
+    Invalidates cached correlation results for one asset, or the whole cache if no
+    asset_id is given.
+    """
+    removed = correlation_cache.invalidate(asset_id)
+    return {"asset_id": asset_id, "removed_entries": removed}
+
+
+@app.get("/v1/precompute")
+def list_precompute_groups():
+    """
+    Lists the registered precompute groups with the time of their last computation.
+    """
+    return precompute_store.status()
+
+
+@app.post("/v1/precompute")
+def register_precompute_group(group: PrecomputeGroup):
+    """
+    Registers (or replaces) an asset group whose correlations are computed right away
+    and then recomputed daily at its refresh_hour. Matching /v1/correlate and
+    /v1/correlate-children requests are answered from the stored result.
+    """
     try:
-        scatter_result = in_depth_plot_scatter(
-            df_infos, output_file="/tmp/in_depth_scatter.png"
-        )
+        precompute_store.register(group)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return {"name": group.name, "registered": True}
 
-    end_time = request.end_time or datetime.now(pytz.timezone("Europe/Berlin"))
 
-    pdf_file_path = "/tmp/correlation_report.pdf"
-    create_pdf(
-        request.start_time,
-        request.end_time,
-        pdf_file_path,
-        correlations,
-        include_heatmap,
-        include_scatter,
-        include_lag_plots,
-        include_details,
-        lag_plot_filenames,
-    )
-    if request.to_email:
-        send_evaluation_report_as_mail(pdf_file_path, request.to_email)
-    return FileResponse(
-        pdf_file_path, media_type="application/pdf", filename="correlation_report.pdf"
-    )
+@app.delete("/v1/precompute/{name}")
+def remove_precompute_group(name: str):
+    if not precompute_store.remove(name):
+        raise HTTPException(status_code=404, detail=f"Unknown group '{name}'.")
+    return {"name": name, "removed": True}
+
+
+def stored_profile(profile_id: str, filename: str, token: Optional[str]) -> str:
+    if not valid_token(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token.")
+    path = profile_path(profile_id, filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile '{profile_id}'.")
+    return path
+
+
+@app.get("/v1/profiles/{profile_id}")
+def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    """
+    Summary of a profiled request: duration, peak traced memory and the top
+    allocation sites in the data, correlation, plotting and PDF modules.
+    """
+    with open(stored_profile(profile_id, "summary.json", x_profile_token)) as f:
+        return json.load(f)
+
+
+@app.get("/v1/profiles/{profile_id}/stacks", response_class=PlainTextResponse)
+def get_profile_stacks(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    """
+    Sampled stacks of a profiled request in the collapsed format ("frame;frame count"
+    per line) read by flamegraph.pl and speedscope.
+    """
+    with open(stored_profile(profile_id, "stacks.folded", x_profile_token)) as f:
+        return f.read()
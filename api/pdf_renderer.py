@@ -0,0 +1,113 @@
+import io
+import logging
+import queue
+import threading
+import time
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+
+class RenderJob:
+    def __init__(self, html, target, base_url):
+        self.html = html
+        self.target = target
+        self.base_url = base_url
+        self.done = threading.Event()
+        self.error = None
+
+
+def offline_url_fetcher():
+    """URL fetcher that only loads local files and data: URLs, never the network."""
+    try:
+        from weasyprint.urls import URLFetcher
+    except ImportError:  # older WeasyPrint versions take a plain function
+        from weasyprint import default_url_fetcher
+
+        def fetch(url, *args, **kwargs):
+            if not url.startswith(("file:", "data:")):
+                raise ValueError(f"Not fetching {url}: rendering is offline")
+            return default_url_fetcher(url, *args, **kwargs)
+
+        return fetch
+    return URLFetcher(allowed_protocols={"file", "data"})
+
+
+class PdfRenderer:
+    """
+    Long-lived WeasyPrint worker. A single daemon thread owns the font configuration and
+    the parsed stylesheet, which are created once and reused for every report, and
+    renders the submitted documents one after another.
+    """
+
+    def __init__(self, css: str):
+        self.css = css
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.renders = 0
+
+    def start(self, warm_up: bool = False):
+        """Starts the worker thread (once); warm_up renders a blank page right away."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="pdf-renderer", daemon=True
+                )
+                self._thread.start()
+        if warm_up:
+            self._jobs.put(RenderJob("<p>warm-up</p>", io.BytesIO(), None))
+
+    def render(self, html: str, target, base_url: str = None):
+        """Renders the HTML string to 'target' (path or file object) and waits for it."""
+        self.start()
+        job = RenderJob(html, target, base_url)
+        self._jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+
+    def _setup(self):
+        from weasyprint import CSS, HTML
+        from weasyprint.text.fonts import FontConfiguration
+
+        started = time.monotonic()
+        self._html = HTML
+        self._url_fetcher = offline_url_fetcher()
+        self._font_config = FontConfiguration()
+        self._stylesheet = CSS(
+            string=self.css,
+            font_config=self._font_config,
+            url_fetcher=self._url_fetcher,
+        )
+        logger.info(f"PDF renderer ready in {time.monotonic() - started:.2f}s")
+
+    def _run(self):
+        setup_error = None
+        try:
+            self._setup()
+        except Exception as e:
+            setup_error = e
+            logger.error(f"Could not set up the PDF renderer: {e}")
+
+        while True:
+            job = self._jobs.get()
+            try:
+                if setup_error is not None:
+                    raise setup_error
+                started = time.monotonic()
+                self._html(
+                    string=job.html,
+                    base_url=job.base_url,
+                    url_fetcher=self._url_fetcher,
+                ).write_pdf(
+                    job.target,
+                    stylesheets=[self._stylesheet],
+                    font_config=self._font_config,
+                )
+                self.renders += 1
+                logger.info(f"Rendered PDF in {time.monotonic() - started:.2f}s")
+            except Exception as e:
+                job.error = e
+            finally:
+                job.done.set()
@@ -4,6 +4,14 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import base64
 import io
+import os
+
+# Above this many joined points the scatter plot is drawn as a density raster
+scatter_density_threshold = int(os.getenv("SCATTER_DENSITY_THRESHOLD", 20_000))
+# Points overlaid on the density raster, sampled evenly over time
+scatter_sample_points = int(os.getenv("SCATTER_SAMPLE_POINTS", 2_000))
+# Hexagons across the x-axis of the density raster
+scatter_gridsize = 80
 
 
 def create_best_correlation_heatmap(correlations_dict, output_file="/tmp/heatmap.png"):
@@ -76,55 +84,105 @@ def create_best_correlation_heatmap(correlations_dict, output_file="/tmp/heatmap
     plt.close()  # Close the figure to free resources
 
 
-def in_depth_plot_scatter(df_info_list, output_file="/tmp/in_depth_scatter.png"):
+def linear_fit(x_vals, y_vals, chunk_size=1_000_000):
     """
-    Accepts a list of TWO DataFrameInfo objects (each with one column),
-    merges them, computes correlation, and returns:
-      - correlation value
-      - base64-encoded PNG scatter plot of one column on the x-axis, the other on the y-axis
-
-    The resulting plot is saved to 'output_file' and also encoded in Base64 so you can return it in JSON.
+    Least-squares line (slope, intercept) from sums accumulated chunk by chunk around the
+    first point, or None if all x values are the same.
+    """
+    x0, y0 = x_vals[0], y_vals[0]
+    n = sum_x = sum_y = sum_xx = sum_xy = 0.0
+    for start in range(0, len(x_vals), chunk_size):
+        x = x_vals[start : start + chunk_size] - x0
+        y = y_vals[start : start + chunk_size] - y0
+        n += len(x)
+        sum_x += x.sum()
+        sum_y += y.sum()
+        sum_xx += np.dot(x, x)
+        sum_xy += np.dot(x, y)
+    var_x = n * sum_xx - sum_x**2
+    if var_x <= 0:
+        return None
+    slope = (n * sum_xy - sum_x * sum_y) / var_x
+    intercept = y0 + (sum_y - slope * sum_x) / n - slope * x0
+    return slope, intercept
+
+
+def stratified_sample(length, points, seed=0):
+    """Sorted positions of one random point from each of 'points' equal time strata."""
+    if length <= points:
+        return np.arange(length)
+    edges = np.linspace(0, length, points + 1).astype(np.int64)
+    rng = np.random.default_rng(seed)
+    return edges[:-1] + (rng.random(points) * np.diff(edges)).astype(np.int64)
+
+
+def draw_scatter(fig, ax, x_vals, y_vals):
     """
-    if len(df_info_list) != 2:
-        raise ValueError("Exactly two DataFrameInfo objects are required.")
+    Scatter plot of y_vals over x_vals with a best-fit line. Above
+    SCATTER_DENSITY_THRESHOLD points, it is a hexbin density raster overlaid with
+    SCATTER_SAMPLE_POINTS points sampled evenly over time, so the render time and PNG
+    size don't grow with the series length.
+    """
+    if len(x_vals) > scatter_density_threshold:
+        density = ax.hexbin(
+            x_vals,
+            y_vals,
+            gridsize=scatter_gridsize,
+            bins="log",
+            cmap="Blues",
+            mincnt=1,
+        )
+        fig.colorbar(density, ax=ax, label="Points")
+        sample = stratified_sample(len(x_vals), scatter_sample_points)
+        ax.scatter(x_vals[sample], y_vals[sample], c="k", s=2, alpha=0.4, linewidths=0)
+    else:
+        ax.scatter(x_vals, y_vals, c="blue", alpha=0.6, edgecolor="k")
+
+    # Plot a best-fit line (linear regression) for visual emphasis, unless all x
+    # values are the same (vertical line)
+    fit = linear_fit(x_vals, y_vals)
+    if fit is not None:
+        slope, intercept = fit
+        x_range = np.array([x_vals.min(), x_vals.max()])
+        ax.plot(
+            x_range,
+            slope * x_range + intercept,
+            color="red",
+            linewidth=2,
+            label="Best Fit",
+        )
+        ax.legend()
 
-    df_info1, df_info2 = df_info_list
-    df1 = df_info1.dataframe
-    df2 = df_info2.dataframe
 
-    col1 = df1.columns[0]
-    col2 = df2.columns[0]
+def in_depth_plot_scatter(aligned_pair, output_file="/tmp/in_depth_scatter.png"):
+    """
+    Accepts the AlignedPair of two columns as compute_correlation matched them (see
+    compute_correlation(return_aligned=True)) and returns:
+      - the pair's correlation at that lag
+      - base64-encoded PNG scatter plot of one column on the x-axis, the other on the y-axis
 
-    # Merge/align on timestamps by an inner join
-    df_merged = df1.join(df2, how="inner").dropna()
-    if df_merged.shape[0] < 2:
+    The resulting plot is saved to 'output_file' and also encoded in Base64 so you can return it in JSON.
+    """
+    col1, col2 = aligned_pair.columns
+    x_vals = np.asarray(aligned_pair.values1, dtype=float)
+    y_vals = np.asarray(aligned_pair.values2, dtype=float)
+    if len(x_vals) < 2:
         raise ValueError("Not enough overlapping data points to compute correlation.")
-
-    # Compute correlation
-    correlation_value = df_merged.corr().iloc[0, 1]
-    correlation_value_rounded = round(correlation_value, 4)
+    correlation_value_rounded = aligned_pair.correlation
 
     # Create a scatter plot: x = col1, y = col2
     fig, ax = plt.subplots(figsize=(8, 6))
-    ax.scatter(df_merged[col1], df_merged[col2], c="blue", alpha=0.6, edgecolor="k")
+    draw_scatter(fig, ax, x_vals, y_vals)
     ax.set_xlabel(col1)
     ax.set_ylabel(col2)
-    ax.set_title(f"Scatter: {col1} vs. {col2} (Corr={correlation_value_rounded})")
-
-    # Optional: Plot a best-fit line (linear regression) for visual emphasis
-    # We use np.polyfit to get slope, intercept
-    x_vals = df_merged[col1].values
-    y_vals = df_merged[col2].values
-
-    # np.polyfit can fail if all x values are the same (vertical line), so handle exceptions
-    try:
-        slope, intercept = np.polyfit(x_vals, y_vals, 1)
-        best_fit_line = slope * x_vals + intercept
-        ax.plot(x_vals, best_fit_line, color="red", linewidth=2, label="Best Fit")
-        ax.legend()
-    except np.linalg.LinAlgError:
-        # Could happen if there's no variation in x_vals
-        pass
+    lag_label = (
+        f", lag {aligned_pair.lag_step} {aligned_pair.lag_unit.value}"
+        if aligned_pair.lag_step
+        else ""
+    )
+    ax.set_title(
+        f"Scatter: {col1} vs. {col2} (Corr={correlation_value_rounded}{lag_label})"
+    )
 
     plt.tight_layout()
 
@@ -145,7 +203,9 @@ def in_depth_plot_scatter(df_info_list, output_file="/tmp/in_depth_scatter.png")
     }
 
 
-def plot_lag_correlations(correlations_dict, output_dir="/tmp/lag_plots"):
+def plot_lag_correlations(
+    correlations_dict, output_dir="/tmp/lag_plots", aligned_pairs=None
+):
     """
     For each pair of columns in 'correlations_dict', we look at 'lag_details'
     and group them by lag_unit (e.g., hours, days). Then we make a separate plot
@@ -155,6 +215,10 @@ def plot_lag_correlations(correlations_dict, output_dir="/tmp/lag_plots"):
 
     We skip pairs like "colA and colB" if we've already handled "colB and colA".
     Also skip self-correlation pairs like "colA and colA".
+
+    'aligned_pairs' optionally holds the matched samples of the pairs as returned by
+    compute_correlation(return_aligned=True). The plot of the best lag's unit then marks
+    the best lag and shows the scatter plot of the samples matched at it.
     """
     import os
     import matplotlib.pyplot as plt
@@ -196,13 +260,29 @@ def plot_lag_correlations(correlations_dict, output_dir="/tmp/lag_plots"):
             if corr is not None:
                 lag_data_by_unit.setdefault(unit, []).append((step, corr))
 
+        best_lag = (aligned_pairs or {}).get(pair_name, {}).get("best_lag")
+        if best_lag is not None and (
+            best_lag.lag_unit is None or len(best_lag.values1) < 2
+        ):
+            best_lag = None
+
         # Plot one figure per lag_unit
         for unit, values in lag_data_by_unit.items():
             values.sort(key=lambda x: x[0])  # sort by lag_step
             x_vals = [v[0] for v in values]
             y_vals = [v[1] for v in values]
 
-            fig, ax = plt.subplots(figsize=(6, 4))
+            if best_lag is not None and best_lag.lag_unit == unit:
+                fig, (ax, scatter_ax) = plt.subplots(1, 2, figsize=(12, 4))
+                draw_scatter(fig, scatter_ax, best_lag.values1, best_lag.values2)
+                scatter_ax.set_xlabel(col1)
+                scatter_ax.set_ylabel(col2)
+                scatter_ax.set_title(
+                    f"Lag {best_lag.lag_step} {unit} (Corr={best_lag.correlation})"
+                )
+                ax.axvline(best_lag.lag_step, color="red", linewidth=1, linestyle=":")
+            else:
+                fig, ax = plt.subplots(figsize=(6, 4))
             ax.plot(x_vals, y_vals, marker="o", linestyle="-")
             ax.set_xlabel(f"Lag (in {unit})")
             ax.set_ylabel("Correlation")
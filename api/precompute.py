@@ -0,0 +1,222 @@
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytz
+
+from api.correlation import compute_correlation, get_data, make_offset
+from api.correlation_cache import normalize_lag_spec
+from api.get_trend_data import get_all_asset_children
+from api.models import CorrelationMethod, CorrelationRequest, PrecomputeGroup
+from api.series_store import release_series
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+timezone = pytz.timezone("Europe/Berlin")
+
+# How often the scheduler checks for groups that are due
+check_interval_seconds = float(os.getenv("PRECOMPUTE_CHECK_INTERVAL_SECONDS", 60))
+# Optional JSON file with a list of groups registered at startup
+groups_file = os.getenv("PRECOMPUTE_GROUPS_FILE")
+
+
+def request_key(assets, lags, method):
+    """Identifies a correlation request by its assets (in any order), lag spec and method."""
+    return (
+        tuple(sorted((asset.asset_id, asset.attribute_name or "") for asset in assets)),
+        normalize_lag_spec(lags),
+        CorrelationMethod(method).value,
+    )
+
+
+def latest_refresh_time(now: datetime, refresh_hour: int) -> datetime:
+    """The most recent daily refresh time at or before 'now'."""
+    scheduled = now.replace(hour=refresh_hour, minute=0, second=0, microsecond=0)
+    if scheduled > now:
+        scheduled -= timedelta(days=1)
+    return scheduled
+
+
+class PrecomputeStore:
+    """
+    Registered asset groups and their latest precomputed correlation results.
+
+    The scheduler thread (start()) computes new groups right away and then recomputes
+    every group once a day at its refresh_hour, using the regular get_data /
+    compute_correlation pipeline. lookup() answers matching interactive requests from
+    the stored results.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, group: PrecomputeGroup):
+        if (group.asset_id is None) == (group.assets is None):
+            raise ValueError("Either asset_id or assets must be given.")
+        if not group.window or any(value <= 0 for value in group.window.values()):
+            raise ValueError("Window must be a positive {unit: value}.")
+        with self._lock:
+            self._groups[group.name] = group
+            self._results.pop(group.name, None)
+        self._wakeup.set()
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            self._results.pop(name, None)
+            return self._groups.pop(name, None) is not None
+
+    def status(self):
+        with self._lock:
+            status = []
+            for name, group in self._groups.items():
+                result = self._results.get(name, {})
+                status.append(
+                    {
+                        "group": group,
+                        "computed_at": result.get("computed_at"),
+                        "start_time": result.get("start_time"),
+                        "end_time": result.get("end_time"),
+                        "duration_seconds": result.get("duration_seconds"),
+                        "error": result.get("error"),
+                    }
+                )
+            return status
+
+    def due_groups(self, now: datetime):
+        with self._lock:
+            due = []
+            for name, group in self._groups.items():
+                attempted_at = self._results.get(name, {}).get("attempted_at")
+                if attempted_at is None or attempted_at < latest_refresh_time(
+                    now, group.refresh_hour
+                ):
+                    due.append(group)
+            return due
+
+    def refresh(self, group: PrecomputeGroup):
+        """Computes a group over its window ending now and stores the result."""
+        started = time.monotonic()
+        end_time = datetime.now(timezone)
+        start_time = pd.Timestamp(end_time)
+        for unit, value in group.window.items():
+            start_time = start_time - make_offset(unit, value)
+        start_time = start_time.to_pydatetime()
+        result = {"attempted_at": end_time}
+
+        try:
+            assets = (
+                get_all_asset_children(group.asset_id)
+                if group.asset_id is not None
+                else group.assets
+            )
+            request = CorrelationRequest(
+                assets=assets,
+                lags=group.lags,
+                start_time=start_time,
+                end_time=end_time,
+                method=group.method,
+            )
+            dataframes = get_data(request)
+            try:
+                correlations = compute_correlation(dataframes, request)
+            finally:
+                release_series(dataframes)
+            result.update(
+                key=request_key(assets, group.lags, group.method),
+                assets=assets,
+                correlation=correlations,
+                start_time=start_time,
+                end_time=end_time,
+                computed_at=datetime.now(timezone),
+                duration_seconds=round(time.monotonic() - started, 3),
+            )
+            logger.info(
+                f"Precomputed group '{group.name}' in {result['duration_seconds']}s"
+            )
+        except Exception as e:
+            result["error"] = str(e)
+            logger.error(f"Precomputing group '{group.name}' failed: {e}")
+
+        with self._lock:
+            if self._groups.get(group.name) is not group:
+                return  # removed or re-registered in the meantime
+            previous = self._results.get(group.name, {})
+            if "error" in result and "correlation" in previous:
+                # Keep serving the last successful result
+                result = {**previous, **result}
+            self._results[group.name] = result
+
+    def lookup(self, request: CorrelationRequest):
+        """
+        Returns the stored result matching the request's assets, lags and method whose
+        time window is within the group's max_age_hours of the requested one, or None.
+        Requests without a start_time never match.
+        """
+        if request.start_time is None:
+            return None
+        key = request_key(request.assets, request.lags, request.method)
+        start_time = request.start_time.astimezone(timezone)
+        end_time = (
+            request.end_time.astimezone(timezone)
+            if request.end_time
+            else datetime.now(timezone)
+        )
+        with self._lock:
+            for name, result in self._results.items():
+                if result.get("key") != key:
+                    continue
+                max_age = timedelta(hours=self._groups[name].max_age_hours)
+                if (
+                    abs(start_time - result["start_time"]) <= max_age
+                    and abs(end_time - result["end_time"]) <= max_age
+                ):
+                    return {"group": name, **copy.deepcopy(result)}
+        return None
+
+    def load_groups_file(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            for group in json.load(f):
+                self.register(PrecomputeGroup(**group))
+
+    def run(self):
+        while not self._stop.is_set():
+            for group in self.due_groups(datetime.now(timezone)):
+                if self._stop.is_set():
+                    break
+                self.refresh(group)
+            self._wakeup.wait(check_interval_seconds)
+            self._wakeup.clear()
+
+    def start(self):
+        """Starts the scheduler in a daemon thread, registering the groups file if set."""
+        if groups_file:
+            try:
+                self.load_groups_file(groups_file)
+            except Exception as e:
+                logger.error(
+                    f"Could not load precompute groups from {groups_file}: {e}"
+                )
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="precompute-scheduler", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+
+precompute_store = PrecomputeStore()
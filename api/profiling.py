@@ -0,0 +1,315 @@
+import contextvars
+import functools
+import hmac
+import inspect
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from fastapi.routing import APIRoute
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+# Requests sending this token in the X-Profile-Token header are profiled; profiling
+# is disabled if it is not set
+profiling_token = os.getenv("PROFILING_TOKEN")
+profiles_dir = os.getenv("PROFILING_DIR", "/tmp/profiles")
+sample_interval_seconds = float(os.getenv("PROFILING_INTERVAL_MS", 5)) / 1000
+# Number of stored profiles kept in PROFILING_DIR, the oldest are deleted beyond it
+profiles_keep = max(1, int(os.getenv("PROFILING_KEEP", 100)))
+profile_header = b"x-profile-token"
+# Requests for stored profiles carry the token as well, but are never profiled
+profiles_path = "/v1/profiles"
+
+# Modules whose allocation sites are reported
+profiled_modules = ("get_trend_data", "correlation", "plot_correlation", "pdf_template")
+top_allocations = 25
+# Frames kept per allocation to find the calling site in the profiled modules
+traceback_frames = 25
+# Long-lived threads doing work for requests (PDF rendering, precomputed groups), also
+# sampled while a request is profiled
+background_threads = ("pdf-renderer", "precompute-scheduler")
+
+# The profile of the current request, None unless the request asked for one
+current_profile = contextvars.ContextVar("current_profile", default=None)
+# tracemalloc is process-wide, so one request is profiled at a time
+profiling_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def frame_label(code) -> str:
+    filename = code.co_filename
+    for path in sys.path:
+        if path and filename.startswith(path):
+            filename = os.path.relpath(filename, path)
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def allocation_site(traceback):
+    """Innermost frame of an allocation traceback in one of the profiled modules."""
+    for frame in reversed(traceback):
+        name = os.path.splitext(os.path.basename(frame.filename))[0]
+        if name in profiled_modules and f"{os.sep}api{os.sep}" in frame.filename:
+            return f"api/{name}.py:{frame.lineno}"
+    return None
+
+
+def is_idle(frame) -> bool:
+    """Whether a thread's innermost frame is waiting on a lock, event or queue."""
+    code = frame.f_code
+    return code.co_name == "wait" and code.co_filename == threading.__file__
+
+
+class RequestProfile:
+    """
+    Sampling profile of one request: a sampler thread records the stack of the thread
+    running the endpoint every PROFILING_INTERVAL_MS as collapsed stacks (one
+    "frame;frame;frame count" line per stack, the input of flamegraph.pl and
+    speedscope), and tracemalloc snapshots taken as the traced memory grows give the
+    allocation sites at the peak. The busy stacks of the background_threads are
+    recorded as well, under a root frame with the thread's name.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread_ids = set()
+        self._peak_snapshot = None
+        self._snapshot_size = 0
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        tracemalloc.start(traceback_frames)
+        self._sampler = threading.Thread(
+            target=self._sample, name=f"profiler-{self.profile_id}", daemon=True
+        )
+        self._sampler.start()
+
+    def stop(self):
+        self.duration_seconds = time.perf_counter() - self.started
+        self._stop.set()
+        self._sampler.join()
+        _, self.peak_bytes = tracemalloc.get_traced_memory()
+        if self._peak_snapshot is None:
+            self._peak_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    def _sample(self):
+        last_snapshot = 0.0
+        while not self._stop.wait(sample_interval_seconds):
+            frames = sys._current_frames()
+            sampled = [(thread_id, None) for thread_id in list(self.thread_ids)]
+            sampled += [
+                (thread.ident, thread.name)
+                for thread in threading.enumerate()
+                if thread.name in background_threads
+            ]
+            for thread_id, root in sampled:
+                frame = frames.get(thread_id)
+                if root is not None and (frame is None or is_idle(frame)):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                if root is not None:
+                    stack.append(root)
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+            # Snapshot when the traced memory has grown by 10%, at most every 250 ms
+            current, _ = tracemalloc.get_traced_memory()
+            now = time.perf_counter()
+            if current > 1.1 * self._snapshot_size and now - last_snapshot >= 0.25:
+                self._peak_snapshot = tracemalloc.take_snapshot()
+                self._snapshot_size = current
+                last_snapshot = now
+
+    def allocations(self):
+        """Top allocation sites in the profiled modules at the largest snapshot."""
+        sizes, counts = Counter(), Counter()
+        for stat in self._peak_snapshot.statistics("traceback"):
+            site = allocation_site(stat.traceback)
+            if site is not None:
+                sizes[site] += stat.size
+                counts[site] += stat.count
+        return [
+            {"site": site, "size_bytes": size, "blocks": counts[site]}
+            for site, size in sizes.most_common(top_allocations)
+        ]
+
+    def save(self, status_code: int):
+        """Writes summary.json and stacks.folded to PROFILING_DIR/<profile_id>."""
+        directory = os.path.join(profiles_dir, self.profile_id)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "stacks.folded"), "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        summary = {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": status_code,
+            "duration_seconds": round(self.duration_seconds, 3),
+            "samples": self.samples,
+            "sample_interval_ms": sample_interval_seconds * 1000,
+            "peak_traced_bytes": self.peak_bytes,
+            "top_allocations": self.allocations(),
+        }
+        with open(os.path.join(directory, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"Saved profile {self.profile_id} of {self.method} {self.path}")
+        prune_profiles()
+        return summary
+
+
+def prune_profiles():
+    """Deletes the oldest profiles in PROFILING_DIR beyond PROFILING_KEEP."""
+    try:
+        entries = [
+            entry
+            for entry in os.scandir(profiles_dir)
+            if entry.name.isalnum() and entry.is_dir(follow_symlinks=False)
+        ]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[profiles_keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def valid_token(token) -> bool:
+    return bool(profiling_token) and hmac.compare_digest(
+        str(token or ""), profiling_token
+    )
+
+
+def profile_path(profile_id: str, filename: str) -> str:
+    """Path of a stored profile file, or None if the profile doesn't exist."""
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(profiles_dir, profile_id, filename)
+    return path if os.path.exists(path) else None
+
+
+async def send_error(send, status_code: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests that carry a valid X-Profile-Token header and adds the
+    X-Profile-Id of the stored profile to their response. Other requests are passed
+    through unchanged.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = dict(scope["headers"]).get(profile_header)
+        if token is None or scope["path"].startswith(profiles_path):
+            return await self.app(scope, receive, send)
+
+        if not valid_token(token.decode()):
+            return await send_error(send, 403, "Invalid profiling token.")
+        if not profiling_lock.acquire(blocking=False):
+            return await send_error(send, 409, "Another request is being profiled.")
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", []))
+                    + [(b"x-profile-id", profile.profile_id.encode())],
+                }
+            await send(message)
+
+        reset = current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            current_profile.reset(reset)
+            profile.stop()
+            try:
+                profile.save(status_code)
+            except Exception as e:
+                logger.error(f"Could not save profile {profile.profile_id}: {e}")
+            profiling_lock.release()
+
+
+def profiled(endpoint):
+    """
+    Wraps an endpoint so the thread running it is sampled while its request is
+    profiled (sync endpoints run on a worker thread, not the event loop).
+    """
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            profile = current_profile.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            thread_id = threading.get_ident()
+            profile.thread_ids.add(thread_id)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.thread_ids.discard(thread_id)
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        thread_id = threading.get_ident()
+        profile.thread_ids.add(thread_id)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.thread_ids.discard(thread_id)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """API route whose endpoint can be sampled by ProfilingMiddleware."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
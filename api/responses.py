@@ -0,0 +1,235 @@
+import json
+import math
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class FastJSONResponse(Response):
+    """JSON response serialized with orjson; NaN correlations are written as null."""
+
+    media_type = JSON_MEDIA_TYPE
+
+    def render(self, content) -> bytes:
+        if orjson is None:
+            content = finite_floats(jsonable_encoder(content))
+            return json.dumps(content, allow_nan=False).encode("utf-8")
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+def finite_floats(value):
+    """Replaces NaN and infinite floats in JSON-compatible content with None."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: finite_floats(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite_floats(item) for item in value]
+    return value
+
+
+def unit_name(unit):
+    """Returns the plain string of a LagUnit (or None)."""
+    return getattr(unit, "value", unit)
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """
+    Picks the response media type from the Accept header. Anything that is not an
+    explicit msgpack or Arrow request is answered with JSON.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        candidates.append((-quality, position, media_type.strip().lower()))
+
+    for _, _, media_type in sorted(candidates):
+        if media_type in MSGPACK_MEDIA_TYPES:
+            return MSGPACK_MEDIA_TYPES[0]
+        if media_type == ARROW_MEDIA_TYPE:
+            return ARROW_MEDIA_TYPE
+        if media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            return JSON_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def columnar_correlations(correlations, include_lag_details: bool):
+    """
+    Converts the per-pair correlation dict into a columnar layout: one entry per pair in
+    'pairs' and the best values, plus flat lag arrays referencing pairs by 'pair_index'.
+    Approximate results add 'confidence_interval' and 'sample_size' columns to both.
+    """
+    approximate = any("sample_size" in info for info in correlations.values())
+    extra = ["confidence_interval", "sample_size"] if approximate else []
+    columns = {
+        "pairs": [],
+        "best_correlation": [],
+        "best_lag": [],
+        "lag_unit": [],
+        **{key: [] for key in extra},
+    }
+    lag_columns = {
+        "pair_index": [],
+        "lag_unit": [],
+        "lag_step": [],
+        "correlation": [],
+        **{key: [] for key in extra},
+    }
+
+    for pair_index, (pair_key, info) in enumerate(correlations.items()):
+        columns["pairs"].append(pair_key.split(" and ", 1))
+        columns["best_correlation"].append(info["best_correlation"])
+        columns["best_lag"].append(info["best_lag"])
+        columns["lag_unit"].append(info["lag_unit"])
+        for key in extra:
+            columns[key].append(info.get(key))
+        if include_lag_details:
+            for entry in info["lag_details"]:
+                lag_columns["pair_index"].append(pair_index)
+                lag_columns["lag_unit"].append(entry["lag_unit"])
+                lag_columns["lag_step"].append(entry["lag_step"])
+                lag_columns["correlation"].append(entry["correlation"])
+                for key in extra:
+                    lag_columns[key].append(entry.get(key))
+
+    if include_lag_details:
+        columns["lag_details"] = lag_columns
+    return columns
+
+
+def to_msgpack(payload, correlations, include_lag_details):
+    try:
+        import msgpack
+    except ImportError:
+        raise HTTPException(
+            status_code=406, detail="msgpack responses are not available."
+        )
+
+    content = jsonable_encoder(payload)
+    content["correlation"] = jsonable_encoder(
+        columnar_correlations(correlations, include_lag_details)
+    )
+    return Response(
+        msgpack.packb(content, use_bin_type=True), media_type=MSGPACK_MEDIA_TYPES[0]
+    )
+
+
+def to_arrow(payload, correlations, include_lag_details):
+    """
+    Writes one Arrow IPC stream with a row per pair. Lag details are list columns,
+    the remaining response fields are stored as JSON in the schema metadata.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(
+            status_code=406, detail="Arrow responses require pyarrow to be installed."
+        )
+
+    columns = columnar_correlations(correlations, include_lag_details)
+    table = {
+        "column_1": [pair[0] for pair in columns["pairs"]],
+        "column_2": [pair[1] for pair in columns["pairs"]],
+        "best_correlation": pa.array(columns["best_correlation"], type=pa.float64()),
+        "best_lag": pa.array(columns["best_lag"], type=pa.int64()),
+        "lag_unit": pa.array(
+            [unit_name(unit) for unit in columns["lag_unit"]],
+            type=pa.string(),
+        ),
+    }
+    if "sample_size" in columns:
+        intervals = [
+            interval or [None, None] for interval in columns["confidence_interval"]
+        ]
+        table["confidence_low"] = pa.array([low for low, _ in intervals], pa.float64())
+        table["confidence_high"] = pa.array(
+            [high for _, high in intervals], pa.float64()
+        )
+        table["sample_size"] = pa.array(columns["sample_size"], pa.int64())
+    if include_lag_details:
+        lags = columns["lag_details"]
+        offsets = [0] * (len(columns["pairs"]) + 1)
+        for pair_index in lags["pair_index"]:
+            offsets[pair_index + 1] += 1
+        for i in range(1, len(offsets)):
+            offsets[i] += offsets[i - 1]
+        offsets = pa.array(offsets, type=pa.int32())
+        table["lag_units"] = pa.ListArray.from_arrays(
+            offsets,
+            pa.array([unit_name(unit) for unit in lags["lag_unit"]], pa.string()),
+        )
+        table["lag_steps"] = pa.ListArray.from_arrays(
+            offsets, pa.array(lags["lag_step"], pa.int64())
+        )
+        table["lag_correlations"] = pa.ListArray.from_arrays(
+            offsets, pa.array(lags["correlation"], pa.float64())
+        )
+
+    metadata = {key: value for key, value in payload.items() if key != "correlation"}
+    batch = pa.table(table).replace_schema_metadata(
+        {"response": json.dumps(jsonable_encoder(metadata))}
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_table(batch)
+    return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE)
+
+
+def correlation_response(
+    payload: dict,
+    accept: Optional[str],
+    include_lag_details: bool = False,
+    include_report_html: bool = False,
+):
+    """
+    Serializes a correlation endpoint response in the negotiated format.
+
+    JSON keeps the nested per-pair layout, msgpack and Arrow use the columnar layout.
+    In every format the lag details and the HTML report are only included when
+    requested.
+    """
+    media_type = negotiate_format(accept)
+    compact = media_type != JSON_MEDIA_TYPE
+
+    payload = dict(payload)
+    if not include_report_html:
+        payload.pop("report_html", None)
+    correlations = payload["correlation"]
+
+    if media_type == ARROW_MEDIA_TYPE:
+        return to_arrow(payload, correlations, include_lag_details)
+    if compact:
+        return to_msgpack(payload, correlations, include_lag_details)
+
+    if not include_lag_details:
+        payload["correlation"] = {
+            pair_key: {
+                key: value for key, value in info.items() if key != "lag_details"
+            }
+            for pair_key, info in correlations.items()
+        }
+    payload["assets"] = jsonable_encoder(payload.get("assets"))
+    return FastJSONResponse(payload)
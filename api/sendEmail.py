@@ -17,6 +17,7 @@ def send_email(
     smtp_port,
     smtp_user,
     smtp_password,
+    starttls=True,
 ):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"The file {file_path} does not exist.")
@@ -39,7 +40,8 @@ def send_email(
     msg.attach(part)
 
     with smtplib.SMTP(smtp_server, smtp_port) as server:
-        server.starttls()
+        if starttls:
+            server.starttls()
         server.login(smtp_user, smtp_password)
         server.sendmail(from_email, to_email, msg.as_string())
 
@@ -49,6 +51,7 @@ def send_evaluation_report_as_mail(filepath, toEmail):
     smtp_port = int(os.getenv("SMTP_PORT"))
     smtp_user = os.getenv("SMTP_USER")
     smtp_password = os.getenv("SMTP_PASSWORD")
+    starttls = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
     from_email = smtp_user
     to_email = toEmail
     subject = "Correlation Analysis Report"
@@ -67,5 +70,6 @@ def send_evaluation_report_as_mail(filepath, toEmail):
         smtp_port,
         smtp_user,
         smtp_password,
+        starttls,
     )
     print("Email sent successfully.")
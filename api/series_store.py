@@ -0,0 +1,172 @@
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, ConfigDict
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+# Above this many bytes of fetched series per request, get_data spills them to disk
+memory_budget_bytes = int(
+    float(os.getenv("CORRELATION_MEMORY_BUDGET_MB", 1024)) * 2**20
+)
+# Number of samples processed at once when working on memory-mapped series
+block_size = int(os.getenv("CORRELATION_BLOCK_SIZE", 1_000_000))
+scratch_root = os.getenv("CORRELATION_SCRATCH_DIR") or tempfile.gettempdir()
+
+
+class SeriesStore:
+    """
+    Per-request scratch directory holding memory-mapped binary series files. Call
+    cleanup() once the request is done to delete them.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.directory = tempfile.mkdtemp(
+            prefix="correlation-", dir=root or scratch_root
+        )
+        self._counter = 0
+        logger.info(f"Spilling series to {self.directory}")
+
+    def write(self, dtype, blocks, length):
+        """Writes an iterable of array blocks into a new file and maps it read-only."""
+        self._counter += 1
+        path = os.path.join(self.directory, f"{self._counter}.{np.dtype(dtype).name}")
+        mapped = np.memmap(path, dtype=dtype, mode="w+", shape=(max(length, 1),))
+        offset = 0
+        for block in blocks:
+            mapped[offset : offset + len(block)] = block
+            offset += len(block)
+        mapped.flush()
+        del mapped
+        return np.memmap(path, dtype=dtype, mode="r", shape=(max(length, 1),))[:length]
+
+    def spill(self, df_info):
+        """Moves a single-column DataFrameInfo to disk and returns a MappedSeriesInfo."""
+        df = df_info.dataframe
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        index = df.index.as_unit("ns")
+        return MappedSeriesInfo(
+            name=df.columns[0],
+            timestamps=self.write(np.int64, [index.asi8], len(df)),
+            values=self.write(
+                np.float64, [df.iloc[:, 0].to_numpy(dtype=float)], len(df)
+            ),
+            timezone=str(index.tz) if index.tz is not None else None,
+            frequency=df_info.frequency,
+            data_size=df_info.data_size,
+            start_date=df_info.start_date,
+            end_date=df_info.end_date,
+            store=self,
+        )
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MappedSeriesInfo(BaseModel):
+    """
+    Out-of-core counterpart of DataFrameInfo: timestamps (sorted int64 nanoseconds, UTC)
+    and float64 values are memory-mapped from files in a SeriesStore.
+    """
+
+    name: str
+    timestamps: np.ndarray
+    values: np.ndarray
+    timezone: Optional[str]
+    frequency: Optional[str]
+    data_size: int
+    start_date: Optional[pd.Timestamp]
+    end_date: Optional[pd.Timestamp]
+    store: SeriesStore
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def blocks(self, timestamps=None):
+        """Yields (offset, timestamps, values) blocks of at most block_size samples."""
+        timestamps = self.timestamps if timestamps is None else timestamps
+        for offset in range(0, self.data_size, block_size):
+            end = min(offset + block_size, self.data_size)
+            yield offset, np.asarray(timestamps[offset:end]), np.asarray(
+                self.values[offset:end]
+            )
+
+    def mean(self) -> float:
+        total = sum(float(values.sum()) for _, _, values in self.blocks())
+        return total / self.data_size if self.data_size else np.nan
+
+    def shifted(self, shift):
+        """
+        Applies 'shift' (a function on a DatetimeIndex, e.g. a calendar shift) block by
+        block and stores the result as (timestamps, values), stably sorted by the shifted
+        timestamps the way align_nearest sorts an unsorted right side. Calendar shifts
+        only reorder nearby samples (month ends clamped to a shorter month, DST
+        fall-back), so each block is sorted together with the samples carried over from
+        the previous one.
+        """
+        block_starts = []
+        previous = [np.iinfo(np.int64).min]
+        ordered = [True]
+
+        def shifted_blocks():
+            for _, timestamps, _ in self.blocks():
+                index = pd.DatetimeIndex(timestamps, tz="UTC")
+                if self.timezone:
+                    index = index.tz_convert(self.timezone)
+                block = shift(index).as_unit("ns").asi8
+                ordered[0] &= previous[0] <= block[0] and not np.any(
+                    block[1:] < block[:-1]
+                )
+                block_starts.append(block.min())
+                previous[0] = block[-1]
+                yield block
+
+        unsorted = self.store.write(np.int64, shifted_blocks(), self.data_size)
+        if ordered[0]:
+            return unsorted, self.values
+
+        # Smallest timestamp of all later blocks: anything above it has to wait
+        later_starts = np.minimum.accumulate(
+            np.append(block_starts, np.iinfo(np.int64).max)[::-1]
+        )[::-1][1:]
+
+        def sorted_blocks(column):
+            carry = (np.empty(0, dtype=np.int64), np.empty(0))
+            for (_, timestamps, values), later in zip(
+                self.blocks(unsorted), later_starts
+            ):
+                timestamps = np.concatenate((carry[0], timestamps))
+                values = np.concatenate((carry[1], values))
+                order = np.argsort(timestamps, kind="stable")
+                timestamps, values = timestamps[order], values[order]
+                # Equal timestamps of later blocks come after these in a stable sort
+                split = np.searchsorted(timestamps, later, side="right")
+                carry = (timestamps[split:], values[split:])
+                yield (timestamps, values)[column][:split]
+
+        return (
+            self.store.write(np.int64, sorted_blocks(0), self.data_size),
+            self.store.write(np.float64, sorted_blocks(1), self.data_size),
+        )
+
+
+def is_mapped(series_info) -> bool:
+    return isinstance(series_info, MappedSeriesInfo)
+
+
+def release_series(series_infos):
+    """Deletes the scratch files of any memory-mapped series in the list."""
+    stores = {id(info.store): info.store for info in series_infos if is_mapped(info)}
+    for store in stores.values():
+        store.cleanup()
+
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    """In-memory size of a single-column series (index and values)."""
+    return int(df.index.nbytes + df.memory_usage(index=False).sum())
@@ -0,0 +1,89 @@
+import logging
+import threading
+
+from api.correlation_cache import normalize_lag_spec
+from api.correlation_sampling import approximate_key
+from api.models import CorrelationMethod, CorrelationRequest
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function,
+    callers arriving while it is in flight wait for it and get the same result (or
+    exception). Results are shared, so callers must not modify them.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logger.info(f"Waiting for in-flight {self.name} {key}")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+            }
+
+
+def correlation_request_key(request: CorrelationRequest, *extra):
+    """
+    Normalized identity of the computation behind a CorrelationRequest. Delivery options
+    (to_email, include_lag_details, include_report_html) are not part of it; an open
+    end_time stays None so requests "until now" arriving together are coalesced.
+    """
+    return (
+        tuple((asset.asset_id, asset.attribute_name) for asset in request.assets),
+        normalize_lag_spec(request.lags),
+        request.start_time,
+        request.end_time,
+        CorrelationMethod(request.method).value,
+        approximate_key(request),
+    ) + extra
+
+
+# Trend data fetches, keyed on (asset_id, start_time, end_time or None)
+trend_data_flights = SingleFlight("trend data fetch")
+# Correlation runs and reports, keyed on correlation_request_key()
+correlation_flights = SingleFlight("correlation")
@@ -0,0 +1,33 @@
+import logging
+import os
+import time
+
+# Recorded when main.py imports this module, before any heavy dependency is loaded
+process_started = time.monotonic()
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+startup_time_budget = float(os.getenv("STARTUP_TIME_BUDGET_SECONDS", 3.0))
+
+status = {
+    "ready": False,
+    "startup_seconds": None,
+    "startup_time_budget_seconds": startup_time_budget,
+    "registered": False,
+    "registration_attempts": 0,
+    "registration_error": None,
+}
+
+
+def mark_ready():
+    """Records the measured startup time once the API is able to serve requests."""
+    elapsed = round(time.monotonic() - process_started, 3)
+    status["ready"] = True
+    status["startup_seconds"] = elapsed
+    if elapsed > startup_time_budget:
+        logger.warning(
+            f"Startup took {elapsed}s, exceeding the budget of {startup_time_budget}s"
+        )
+    else:
+        logger.info(f"Startup took {elapsed}s (budget {startup_time_budget}s)")
@@ -0,0 +1,219 @@
+"""
+Local stand-ins for the services the app talks to, for load tests.
+
+FakeElionaServer serves the two Eliona API calls the app makes, GET /assets
+(get_assets) and GET /data-trends (get_data_trends), with a synthetic building:
+asset 1 is the root, assets 2..N+1 are its children (every third one a child of the
+previous asset), each with the same numeric attributes sampled at a fixed frequency.
+Every response is delayed by a configurable latency.
+
+SmtpSink accepts and counts mails (EHLO, AUTH, MAIL, RCPT, DATA) without TLS; run
+the app with SMTP_STARTTLS=false against it.
+
+    python -m benchmarks.fake_eliona --port 8081 --smtp-port 8025
+"""
+
+import argparse
+import json
+import math
+import random
+import socketserver
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+root_asset_id = 1
+
+
+class SyntheticBuilding:
+    def __init__(self, assets=20, attributes=4, frequency_seconds=900, seed=0):
+        self.asset_ids = list(range(root_asset_id + 1, root_asset_id + 1 + assets))
+        self.attributes = [f"attribute_{i}" for i in range(attributes)]
+        self.frequency_seconds = frequency_seconds
+        self.seed = seed
+
+    def assets(self):
+        records = [self.asset_record(root_asset_id, "building", [])]
+        for position, asset_id in enumerate(self.asset_ids):
+            path = [root_asset_id]
+            if position % 3 == 2:
+                path.append(asset_id - 1)
+            records.append(
+                self.asset_record(asset_id, "room" if len(path) > 1 else "ahu", path)
+            )
+        return records
+
+    @staticmethod
+    def asset_record(asset_id, asset_type, path):
+        return {
+            "id": asset_id,
+            "projectId": "1",
+            "globalAssetIdentifier": f"asset-{asset_id}",
+            "name": f"Asset {asset_id}",
+            "assetType": asset_type,
+            "locationalAssetIdPath": path,
+            "functionalAssetIdPath": path,
+        }
+
+    def trends(self, asset_id, start, end):
+        """Samples on the frequency grid within [start, end], one record per timestamp."""
+        step = self.frequency_seconds
+        first = math.ceil(start.timestamp() / step) * step
+        rng = random.Random(self.seed * 100_003 + asset_id)
+        phases = [rng.uniform(0, 2 * math.pi) for _ in self.attributes]
+        records = []
+        t = first
+        while t <= end.timestamp():
+            day = 2 * math.pi * t / 86400
+            data = {
+                attribute: round(
+                    20 + 5 * math.sin(day + phase) + rng.gauss(0, 0.5) + asset_id % 7, 3
+                )
+                for attribute, phase in zip(self.attributes, phases)
+            }
+            records.append(
+                {
+                    "assetId": asset_id,
+                    "subtype": "input",
+                    "timestamp": datetime.fromtimestamp(t, timezone.utc).isoformat(),
+                    "data": data,
+                }
+            )
+            t += step
+        return records
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class FakeElionaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, building, latency_seconds=0.0):
+        super().__init__(address, FakeElionaHandler)
+        self.building = building
+        self.latency_seconds = latency_seconds
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class FakeElionaHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency_seconds)
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip("/")
+        building = self.server.building
+
+        if path.endswith("/assets"):
+            return self.send_json(building.assets())
+        if path.endswith("/data-trends"):
+            try:
+                asset_id = int(query.get("assetId", query.get("asset_id")))
+                start = parse_time(query.get("fromDate", query.get("from_date")))
+                end = parse_time(query.get("toDate", query.get("to_date")))
+            except (TypeError, ValueError) as e:
+                return self.send_json({"message": str(e)}, status=400)
+            if asset_id != root_asset_id and asset_id not in building.asset_ids:
+                return self.send_json([])
+            return self.send_json(building.trends(asset_id, start, end))
+        self.send_json({"message": f"Not found: {url.path}"}, status=404)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 localhost fake SMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250-AUTH PLAIN LOGIN")
+                self.reply("250 SIZE 104857600")
+            elif verb == "AUTH":
+                self.reply("235 Authentication successful")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                self.server.record(size)
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:  # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply("250 OK")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, SmtpHandler)
+        self.messages = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def record(self, size):
+        with self.lock:
+            self.messages += 1
+            self.bytes += size
+
+
+def start_in_background(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--smtp-port", type=int, default=8025)
+    parser.add_argument("--assets", type=int, default=20)
+    parser.add_argument("--attributes", type=int, default=4)
+    parser.add_argument("--frequency-seconds", type=int, default=900)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    building = SyntheticBuilding(args.assets, args.attributes, args.frequency_seconds)
+    eliona = FakeElionaServer(
+        ("127.0.0.1", args.port), building, args.latency_ms / 1000
+    )
+    smtp = SmtpSink(("127.0.0.1", args.smtp_port))
+    start_in_background(smtp)
+    print(
+        f"Eliona API on http://127.0.0.1:{args.port}/v2, SMTP on port {args.smtp_port}"
+    )
+    eliona.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
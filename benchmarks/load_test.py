@@ -0,0 +1,342 @@
+"""
+End-to-end load test of the app against a local fake Eliona API and SMTP sink.
+
+    python -m benchmarks.load_test --scenarios correlate,mixed --requests 50 --concurrency 4
+
+Starts benchmarks.fake_eliona in-process and the app (uvicorn api.openapi:app) as a
+subprocess pointed at it, then drives each scenario's mix of /v1/correlate,
+/v1/correlate-children, /v1/in-depth-correlation and /v1/generate-report requests
+from concurrent clients. Requests use random assets and time windows, so results
+mostly miss the correlation cache. Reports throughput, p50/p95/p99 latency (overall
+and per endpoint), error rates and the app's peak RSS per scenario (read from /proc,
+Linux only).
+"""
+
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fake_eliona import (
+    FakeElionaServer,
+    SmtpSink,
+    SyntheticBuilding,
+    root_asset_id,
+    start_in_background,
+)
+
+# Weights of the request kinds per scenario
+SCENARIOS = {
+    "correlate": {"correlate": 1},
+    "children": {"children": 1},
+    "reports": {"in_depth": 1, "generate_report": 1},
+    "mixed": {"correlate": 6, "children": 2, "in_depth": 1, "generate_report": 1},
+}
+
+ENDPOINTS = {
+    "correlate": "/v1/correlate",
+    "children": "/v1/correlate-children",
+    "in_depth": "/v1/in-depth-correlation",
+    "generate_report": "/v1/generate-report",
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RequestFactory:
+    """Random request bodies over the synthetic building."""
+
+    def __init__(self, building, days, seed=0):
+        self.building = building
+        self.days = days
+        self.rng = random.Random(seed)
+        self.now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    def window(self):
+        end = self.now - timedelta(hours=self.rng.randrange(0, 24 * self.days))
+        return {
+            "start_time": (end - timedelta(days=self.days)).isoformat(),
+            "end_time": end.isoformat(),
+        }
+
+    def attribute(self):
+        return {
+            "asset_id": self.rng.choice(self.building.asset_ids),
+            "attribute_name": self.rng.choice(self.building.attributes),
+        }
+
+    def body(self, kind):
+        lags = [{"hours": self.rng.randint(1, 6)}]
+        if kind == "correlate":
+            return {
+                "assets": [self.attribute() for _ in range(self.rng.randint(2, 5))],
+                "lags": lags,
+                "include_report_html": False,
+                **self.window(),
+            }
+        if kind == "children":
+            return {
+                "asset_id": root_asset_id,
+                "attribute_names": self.rng.sample(self.building.attributes, 2),
+                "lags": lags,
+                "include_report_html": False,
+                **self.window(),
+            }
+        # in_depth and generate_report need exactly two attributes; mail every report
+        return {
+            "assets": [self.attribute(), self.attribute()],
+            "lags": lags,
+            "to_email": "loadtest@example.com",
+            **self.window(),
+        }
+
+
+def post(base_url, path, body, timeout):
+    request = urllib.request.Request(
+        base_url + path,
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception as e:
+        return type(e).__name__
+
+
+class RssSampler:
+    """Samples the resident set size of a process every 50 ms, keeping the maximum."""
+
+    def __init__(self, pid):
+        self.path = f"/proc/{pid}/status"
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def current_kb(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def _run(self):
+        while not self._stop.wait(0.05):
+            self.peak_kb = max(self.peak_kb, self.current_kb())
+
+    def start(self):
+        self._thread.start()
+
+    def reset(self):
+        self.peak_kb = self.current_kb()
+
+    def stop(self):
+        self._stop.set()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def latency_stats(latencies):
+    return {
+        f"p{p}_ms": round(percentile(latencies, p) * 1000, 1) if latencies else None
+        for p in (50, 95, 99)
+    }
+
+
+def run_scenario(name, base_url, factory, requests, concurrency, timeout):
+    weights = SCENARIOS[name]
+    kinds = factory.rng.choices(list(weights), list(weights.values()), k=requests)
+    work = queue.Queue()
+    for kind in kinds:
+        work.put((kind, factory.body(kind)))
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            try:
+                kind, body = work.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            status = post(base_url, ENDPOINTS[kind], body, timeout)
+            with lock:
+                results.append((kind, status, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    errors = [status for _, status, _ in results if status != 200]
+    per_endpoint = {}
+    for kind in weights:
+        kind_results = [r for r in results if r[0] == kind]
+        if kind_results:
+            per_endpoint[kind] = {
+                "requests": len(kind_results),
+                "errors": sum(status != 200 for _, status, _ in kind_results),
+                **latency_stats([latency for _, _, latency in kind_results]),
+            }
+    return {
+        "scenario": name,
+        "requests": len(results),
+        "concurrency": concurrency,
+        "duration_seconds": round(duration, 2),
+        "throughput_rps": round(len(results) / duration, 2),
+        "error_rate": round(len(errors) / len(results), 4) if results else 0,
+        "errors": dict(Counter(str(status) for status in errors)),
+        **latency_stats([latency for _, _, latency in results]),
+        "endpoints": per_endpoint,
+    }
+
+
+def start_app(port, eliona_port, smtp_port):
+    env = {
+        **os.environ,
+        "API_ENDPOINT": f"http://127.0.0.1:{eliona_port}/v2",
+        "API_TOKEN": "load-test",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_USER": "correlation@example.com",
+        "SMTP_PASSWORD": "load-test",
+        "SMTP_STARTTLS": "false",
+    }
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.openapi:app", "--port", str(port)]
+        + ["--log-level", "warning"],
+        cwd=repo_root,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(base_url, app, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if app.poll() is not None:
+            raise RuntimeError(f"The app exited with code {app.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + "/v1/ready", timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("The app did not become ready")
+
+
+def print_result(result):
+    print(
+        f"{result['scenario']:>10}: {result['requests']} requests "
+        f"({result['concurrency']} clients) in {result['duration_seconds']}s, "
+        f"{result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, "
+        f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+        f"errors {result['error_rate']:.1%} {result['errors'] or ''}, "
+        f"peak RSS {result['peak_rss_mb']} MB, {result['mails']} mails"
+    )
+    for kind, stats in result["endpoints"].items():
+        print(
+            f"{'':>12}{ENDPOINTS[kind]}: {stats['requests']} requests, "
+            f"{stats['errors']} errors, p50 {stats['p50_ms']} ms, "
+            f"p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        default="correlate,children,reports,mixed",
+        help="comma-separated",
+    )
+    parser.add_argument("--requests", type=int, default=40, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--assets", type=int, default=20)
+    parser.add_argument("--attributes", type=int, default=4)
+    parser.add_argument("--frequency-seconds", type=int, default=900)
+    parser.add_argument("--days", type=int, default=7, help="time window per request")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Eliona latency")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(
+            f"unknown scenarios {sorted(unknown)}, choose from {list(SCENARIOS)}"
+        )
+
+    building = SyntheticBuilding(
+        args.assets, args.attributes, args.frequency_seconds, args.seed
+    )
+    eliona = FakeElionaServer(("127.0.0.1", 0), building, args.latency_ms / 1000)
+    smtp = SmtpSink(("127.0.0.1", 0))
+    start_in_background(eliona)
+    start_in_background(smtp)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    app = start_app(port, eliona.server_address[1], smtp.server_address[1])
+    sampler = RssSampler(app.pid)
+    results = []
+    try:
+        wait_ready(base_url, app)
+        sampler.start()
+        factory = RequestFactory(building, args.days, args.seed)
+        for name in scenarios:
+            sampler.reset()
+            mails = smtp.messages
+            result = run_scenario(
+                name, base_url, factory, args.requests, args.concurrency, args.timeout
+            )
+            result["peak_rss_mb"] = round(sampler.peak_kb / 1024, 1)
+            result["mails"] = smtp.messages - mails
+            results.append(result)
+            print_result(result)
+    finally:
+        sampler.stop()
+        app.terminate()
+        app.wait(timeout=30)
+        eliona.shutdown()
+        smtp.shutdown()
+
+    print(f"Eliona API requests: {eliona.requests}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Measures the PDF render latency per report.
+
+    python -m benchmarks.pdf_render --reports 20
+
+"cold" renders every report the way create_pdf used to: a new WeasyPrint setup (font
+configuration and stylesheet parsed from scratch) per report, with the Google Fonts
+@imports if --network-fonts is given. "warm" renders through the long-lived
+pdf_renderer with the bundled fonts. Both render the same heatmap report.
+"""
+
+import argparse
+import io
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from api.pdf_renderer import offline_url_fetcher
+from api.pdf_template import (
+    FONT_FACES_CSS,
+    REPORT_CSS,
+    create_html,
+    pdf_renderer,
+    report_dir,
+)
+
+GOOGLE_FONTS_IMPORTS = """
+@import url('https://fonts.googleapis.com/css2?family=Roboto+Slab:wght@100..900&display=swap');
+@import url('https://fonts.googleapis.com/css2?family=Poppins:ital,wght@0,100;0,200;0,300;0,400;0,500;0,600;0,700;0,800;0,900&display=swap');
+"""
+
+
+def sample_correlations(columns=12):
+    names = [f"{1000 + i}_temperature" for i in range(columns)]
+    return {
+        f"{a} and {b}": {
+            "best_correlation": round(1 - abs(i - j) / columns, 4),
+            "best_lag": i - j,
+            "lag_unit": "hours",
+            "lag_details": [],
+        }
+        for i, a in enumerate(names)
+        for j, b in enumerate(names)
+    }
+
+
+def render_cold(html, network_fonts):
+    from weasyprint import CSS, HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    font_config = FontConfiguration()
+    fonts = GOOGLE_FONTS_IMPORTS if network_fonts else FONT_FACES_CSS
+    css = fonts + REPORT_CSS
+    kwargs = {} if network_fonts else {"url_fetcher": offline_url_fetcher()}
+    stylesheet = CSS(string=css, font_config=font_config, **kwargs)
+    HTML(string=html, base_url=report_dir + "/", **kwargs).write_pdf(
+        io.BytesIO(), stylesheets=[stylesheet], font_config=font_config
+    )
+
+
+def render_warm(html):
+    pdf_renderer.render(html, io.BytesIO(), base_url=report_dir + "/")
+
+
+def measure(label, render, reports):
+    latencies = []
+    for _ in range(reports):
+        started = time.perf_counter()
+        render()
+        latencies.append(time.perf_counter() - started)
+    first = latencies[0]
+    latencies.sort()
+    print(
+        f"{label:>6}: first {first:.3f}s "
+        f"median {statistics.median(latencies):.3f}s "
+        f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.3f}s "
+        f"({reports} reports)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument(
+        "--network-fonts",
+        action="store_true",
+        help="load the Google Fonts stylesheets in the cold mode, like the old template",
+    )
+    args = parser.parse_args()
+
+    from api.plot_correlation import create_best_correlation_heatmap
+
+    correlations = sample_correlations()
+    create_best_correlation_heatmap(
+        correlations, output_file=f"{report_dir}/heatmap.png"
+    )
+    end = datetime.now()
+    html = create_html(
+        end - timedelta(days=7),
+        end,
+        correlations,
+        [],
+        include_heatmap=True,
+        include_scatter=False,
+        include_lag_plots=False,
+        include_details=True,
+        inline_css=False,
+    )
+
+    measure("cold", lambda: render_cold(html, args.network_fonts), args.reports)
+    # The first warm render includes the one-time renderer setup
+    measure("warm", lambda: render_warm(html), args.reports)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Checks that the raw-JSON fast path of get_data_trends parses to the same series as
+the typed Eliona client, against benchmarks.fake_eliona serving trend records with
+mixed UTC offsets and non-numeric values.
+
+    python -m benchmarks.trend_parsing_parity --assets 3 --days 12
+
+Fetches every asset once with TREND_DATA_RAW_JSON on and once off and compares the
+per-attribute series; exits with status 1 on any difference.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fake_eliona import (
+    FakeElionaServer,
+    SyntheticBuilding,
+    start_in_background,
+)
+
+# Offsets the records alternate between, as sent by clients in different zones
+utc_offsets = [
+    timedelta(0),
+    timedelta(hours=1),
+    timedelta(hours=2),
+    timedelta(hours=-5),
+]
+# Values the app must skip or convert
+odd_values = ["on", None, "21.5", True, "", "NaN", [1, 2]]
+
+
+class MixedBuilding(SyntheticBuilding):
+    """SyntheticBuilding whose trend records vary their UTC offset and value types."""
+
+    def trends(self, asset_id, start, end):
+        records = super().trends(asset_id, start, end)
+        for position, record in enumerate(records):
+            offset = utc_offsets[position % len(utc_offsets)]
+            timestamp = datetime.fromisoformat(record["timestamp"])
+            record["timestamp"] = timestamp.astimezone(timezone(offset)).isoformat()
+            if position % 7 == 3:
+                attribute = self.attributes[position % len(self.attributes)]
+                record["data"][attribute] = odd_values[position % len(odd_values)]
+            if position % 97 == 5:
+                record["data"] = None
+        return records
+
+
+def fetch_both(get_trend_data, asset_id, start, end):
+    results = []
+    for raw in (True, False):
+        get_trend_data.use_raw_json = raw
+        results.append(get_trend_data.fetch_pandas_data(asset_id, start, end))
+    return results
+
+
+def compare(raw, typed):
+    """Differences between two {attribute: pd.Series} results, as messages."""
+    import pandas as pd
+
+    problems = []
+    if set(raw) != set(typed):
+        problems.append(f"attributes differ: {sorted(raw)} vs {sorted(typed)}")
+    for attribute in sorted(set(raw) & set(typed)):
+        try:
+            pd.testing.assert_series_equal(raw[attribute], typed[attribute])
+        except AssertionError as e:
+            problems.append(f"{attribute}: {e}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--assets", type=int, default=3)
+    parser.add_argument("--attributes", type=int, default=4)
+    parser.add_argument("--frequency-seconds", type=int, default=600)
+    parser.add_argument("--days", type=int, default=12, help="spans several chunks")
+    args = parser.parse_args()
+
+    building = MixedBuilding(args.assets, args.attributes, args.frequency_seconds)
+    eliona = FakeElionaServer(("127.0.0.1", 0), building)
+    start_in_background(eliona)
+    # The client is configured on first use, so the environment is set before
+    os.environ["API_ENDPOINT"] = f"http://127.0.0.1:{eliona.server_address[1]}/v2"
+    os.environ.setdefault("API_TOKEN", "parity-check")
+    from api import get_trend_data
+
+    end = datetime.now(timezone.utc).replace(microsecond=0)
+    start = end - timedelta(days=args.days)
+    failures = 0
+    try:
+        for asset_id in building.asset_ids:
+            raw, typed = fetch_both(get_trend_data, asset_id, start, end)
+            problems = compare(raw, typed)
+            samples = sum(len(series) for series in raw.values())
+            print(
+                f"asset {asset_id}: {len(raw)} attributes, {samples} samples, "
+                + ("identical" if not problems else f"{len(problems)} differences")
+            )
+            for problem in problems:
+                print(f"    {problem}")
+            failures += bool(problems)
+    finally:
+        eliona.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
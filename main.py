@@ -1,6 +1,7 @@
 import os
 import uvicorn
-from register_app import Initialize
+from api import startup  # noqa: F401  (records the process start time)
+from register_app import initialize_in_background
 
 
 def start_api():
@@ -8,5 +9,5 @@ def start_api():
     uvicorn.run("api.openapi:app", host="0.0.0.0", port=port)
 
 
-Initialize()
+initialize_in_background()
 start_api()
@@ -1,30 +1,31 @@
 import logging
 import os
-from eliona.api_client2 import (
-    AppsApi,
-    ApiClient,
-    Configuration,
-)
+import time
+from functools import lru_cache
+from threading import Thread
 
+from api.startup import status
 
-host = os.getenv("API_ENDPOINT")
-api_key = os.getenv("API_TOKEN")
-
-
-configuration = Configuration(host=host)
-configuration.api_key["ApiKeyAuth"] = api_key
-api_client = ApiClient(configuration)
-
+# Initialize the logger
+logger = logging.getLogger(__name__)
 
-apps_api = AppsApi(api_client)
 
+@lru_cache(maxsize=None)
+def get_apps_api():
+    # Imported on first use to keep the Eliona client out of the startup path
+    from eliona.api_client2 import (
+        AppsApi,
+        ApiClient,
+        Configuration,
+    )
 
-# Initialize the logger
-logger = logging.getLogger(__name__)
+    configuration = Configuration(host=os.getenv("API_ENDPOINT"))
+    configuration.api_key["ApiKeyAuth"] = os.getenv("API_TOKEN")
+    return AppsApi(ApiClient(configuration))
 
 
 def Initialize():
-
+    apps_api = get_apps_api()
     app = apps_api.get_app_by_name("correlations")
 
     if not app.registered:
@@ -33,3 +34,34 @@ def Initialize():
 
     else:
         logger.info("App 'correlations' already active.")
+
+
+def initialize_with_retries(max_attempts=10, initial_delay=1.0, max_delay=60.0):
+    delay = initial_delay
+    for attempt in range(1, max_attempts + 1):
+        status["registration_attempts"] = attempt
+        try:
+            Initialize()
+            status["registered"] = True
+            status["registration_error"] = None
+            return True
+        except Exception as e:
+            status["registration_error"] = str(e)
+            logger.warning(f"App registration attempt {attempt} failed: {e}")
+            if attempt < max_attempts:
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+    logger.error(f"App registration failed after {max_attempts} attempts")
+    return False
+
+
+def initialize_in_background():
+    """Registers the app in a daemon thread so the API server can start immediately."""
+    thread = Thread(
+        target=initialize_with_retries,
+        kwargs={"max_attempts": int(os.getenv("REGISTRATION_MAX_ATTEMPTS", 10))},
+        name="app-registration",
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.correlation import align_nearest, pearson
+from api.correlation_kernels import lagged_pearson_kernel
+
+# The kernel as plain Python, also when numba compiled it
+kernel = getattr(lagged_pearson_kernel, "py_func", lagged_pearson_kernel)
+
+minute = pd.Timedelta(minutes=1).value
+
+
+def kernel_correlations(left, right, offsets, tolerance=None):
+    (left_timestamps, left_values), (right_timestamps, right_values) = left, right
+    offsets = np.asarray(offsets, dtype=np.int64)
+    out = np.empty(len(offsets))
+    kernel(
+        np.asarray(left_timestamps, dtype=np.int64),
+        np.asarray(left_values, dtype=np.float64),
+        np.asarray(right_timestamps, dtype=np.int64),
+        np.asarray(right_values, dtype=np.float64),
+        offsets,
+        -1 if tolerance is None else int(pd.Timedelta(tolerance).value),
+        out,
+    )
+    return out
+
+
+def reference_correlations(left, right, offsets, tolerance=None):
+    (left_timestamps, left_values), (right_timestamps, right_values) = left, right
+    left_timestamps = np.asarray(left_timestamps, dtype=np.int64)
+    right_timestamps = np.asarray(right_timestamps, dtype=np.int64)
+    correlations = []
+    for offset in offsets:
+        left_pos, right_pos = align_nearest(
+            left_timestamps, right_timestamps + offset, tolerance=tolerance
+        )
+        correlations.append(
+            pearson(
+                np.asarray(left_values, dtype=float)[left_pos],
+                np.asarray(right_values, dtype=float)[right_pos],
+            )
+        )
+    return np.array(correlations)
+
+
+def assert_same(left, right, offsets, tolerance=None):
+    np.testing.assert_allclose(
+        kernel_correlations(left, right, offsets, tolerance),
+        reference_correlations(left, right, offsets, tolerance),
+        rtol=0,
+        atol=1e-9,
+    )
+
+
+def series(start_minute, count, step_minutes, seed):
+    timestamps = (start_minute + step_minutes * np.arange(count)) * minute
+    return timestamps, np.random.default_rng(seed).normal(size=count)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_series_with_lags(seed):
+    rng = np.random.default_rng(seed)
+    left = series(0, 400, 15, seed)
+    right = series(int(rng.integers(-200, 200)), 120, 60, seed + 100)
+    offsets = np.arange(-48, 49, 7) * 15 * minute
+    assert_same(left, right, offsets, tolerance=pd.Timedelta(minutes=15))
+    assert_same(left, right, offsets)
+
+
+def test_irregular_timestamps():
+    rng = np.random.default_rng(7)
+    left_timestamps = np.sort(rng.choice(100_000, 500, replace=False)) * minute
+    right_timestamps = np.sort(rng.choice(100_000, 300, replace=False)) * minute
+    left = (left_timestamps, rng.normal(size=500))
+    right = (right_timestamps, rng.normal(size=300))
+    assert_same(left, right, [-90 * minute, 0, 13 * minute], pd.Timedelta(minutes=30))
+
+
+def test_empty_series():
+    empty = (np.empty(0, dtype=np.int64), np.empty(0))
+    some = series(0, 10, 15, 1)
+    for left, right in [(empty, some), (some, empty), (empty, empty)]:
+        assert np.isnan(kernel_correlations(left, right, [0, minute])).all()
+        assert_same(left, right, [0, minute])
+
+
+def test_no_overlap_within_tolerance():
+    left = series(0, 50, 15, 1)
+    right = series(10_000, 50, 15, 2)
+    assert np.isnan(kernel_correlations(left, right, [0], pd.Timedelta(minutes=15)))
+    assert_same(left, right, [0], pd.Timedelta(minutes=15))
+    # An offset that moves the right series back over the left one
+    assert_same(left, right, [-10_000 * minute], pd.Timedelta(minutes=15))
+
+
+def test_single_match_is_nan():
+    left = series(0, 10, 15, 1)
+    right = ([30 * minute], [1.0])
+    assert_same(left, right, [0], pd.Timedelta(minutes=5))
+    assert np.isnan(kernel_correlations(left, right, [0], pd.Timedelta(minutes=5)))
+
+
+def test_ties_resolve_backward():
+    # Every left timestamp lies exactly between two right timestamps
+    left = (
+        (np.arange(40) * 20 + 10) * minute,
+        np.random.default_rng(1).normal(size=40),
+    )
+    right = (np.arange(41) * 20 * minute, np.random.default_rng(2).normal(size=41))
+    assert_same(left, right, [0, 20 * minute, -20 * minute])
+    assert_same(left, right, [0], pd.Timedelta(minutes=10))  # inclusive tolerance
+    assert_same(left, right, [0], pd.Timedelta(minutes=9))  # nothing matches
+
+
+def test_duplicate_right_timestamps():
+    rng = np.random.default_rng(3)
+    right_timestamps = np.repeat(np.arange(30) * 60, 2) * minute
+    left = series(0, 120, 15, 4)
+    right = (right_timestamps, rng.normal(size=60))
+    assert_same(left, right, [0, 30 * minute], pd.Timedelta(minutes=30))
+
+
+def test_constant_values_are_nan():
+    left = (series(0, 50, 15, 1)[0], np.full(50, 3.0))
+    right = series(0, 50, 15, 2)
+    assert np.isnan(kernel_correlations(left, right, [0]))
+    assert_same(left, right, [0])
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import api.series_store as series_store
+from api.correlation import DataFrameInfo, compute_correlation, shift_index
+from api.correlation_cache import correlation_cache
+from api.models import CorrelationRequest, LagUnit
+from api.series_store import SeriesStore, release_series
+
+
+def series_info(name, start, periods, freq, seed):
+    index = pd.date_range(start, periods=periods, freq=freq, tz="Europe/Berlin")
+    values = np.cumsum(np.random.default_rng(seed).normal(size=periods))
+    return DataFrameInfo(
+        dataframe=pd.DataFrame({name: values}, index=index),
+        frequency={"15min": "15T", "h": "H"}[freq],
+        data_size=periods,
+        start_date=index[0],
+        end_date=index[-1],
+    )
+
+
+@pytest.fixture
+def store(monkeypatch):
+    # Small blocks, so reordered samples cross block boundaries
+    monkeypatch.setattr(series_store, "block_size", 97)
+    store = SeriesStore()
+    yield store
+    store.cleanup()
+
+
+@pytest.mark.parametrize(
+    "start, lag_unit, step",
+    [
+        ("2024-01-27", LagUnit.months, 1),  # Jan 29-31 clamp to Feb 29
+        ("2024-03-29", LagUnit.months, -1),  # Mar 29-31 clamp to Feb 29
+        ("2024-10-25", LagUnit.years, 1),  # DST fall-back hour
+        ("2024-02-27", LagUnit.years, 1),  # Feb 29 clamps to Feb 28
+    ],
+)
+def test_shifted_matches_in_memory_sort(store, start, lag_unit, step):
+    info = series_info("1_a", start, 700, "15min", seed=1)
+    index = info.dataframe.index
+    shifted = shift_index(index, lag_unit, step).as_unit("ns").asi8
+    order = np.argsort(shifted, kind="stable")
+
+    timestamps, values = store.spill(info).shifted(
+        lambda index: shift_index(index, lag_unit, step)
+    )
+
+    np.testing.assert_array_equal(timestamps, shifted[order])
+    np.testing.assert_array_equal(values, info.dataframe.iloc[:, 0].to_numpy()[order])
+
+
+@pytest.mark.parametrize(
+    "start, lags",
+    [
+        ("2024-01-27", [{"months": 1}]),
+        ("2024-03-29", [{"months": 2}]),
+        ("2024-10-25", [{"years": 1}, {"hours": 5}]),
+    ],
+)
+def test_mapped_correlations_match_in_memory(store, start, lags):
+    infos = [
+        series_info("1_a", start, 6000, "15min", seed=1),
+        series_info("2_b", start, 1500, "h", seed=2),
+        series_info("3_c", start, 4000, "15min", seed=3),
+    ]
+    request = CorrelationRequest(assets=[{"asset_id": 1}], lags=lags)
+
+    correlation_cache.invalidate()
+    in_memory = compute_correlation(infos, request)
+    mapped = [store.spill(info) for info in infos]
+    correlation_cache.invalidate()
+    try:
+        assert compute_correlation(mapped, request) == in_memory
+    finally:
+        release_series(mapped)
+        correlation_cache.invalidate()